@@ -0,0 +1,119 @@
+import argparse
+import functools
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import main as scraper
+import partitions
+import rollups
+import weather_db
+from instrumentation import Metrics, get_logger
+from page_archive import PageArchive, archive_dir, load_page
+
+
+logger = get_logger('backfill')
+metrics = Metrics('backfill')
+
+database_file_path = os.environ.get('DATABASE_FILE_PATH', weather_db.database_file_path)
+
+# Pages handed to a worker process at a time
+chunk_size = int(os.environ.get('BACKFILL_CHUNK_SIZE', 16))
+
+
+@functools.lru_cache(maxsize=None)
+def archived_tide_tables(path, sha256):
+    """Parses every day's tide table from an archived tide page, once per page."""
+    return scraper.parse_all_tide_tables(load_page(path, sha256))
+
+
+def resolve_tide_times(archive, tide_url, fetched_at):
+    """Finds the tide times a weather page fetched at fetched_at was paired with.
+
+    The scraper only downloads a tide page when its cache has no table for the
+    day, so the times come from the newest archived tide page fetched at or
+    before the weather page that has a table for that day.
+    """
+    date = fetched_at[:10]
+    if tide_url:
+        for sha256 in archive.tide_pages(tide_url, fetched_at):
+            tide_tables = archived_tide_tables(archive.path, sha256)
+            if date in tide_tables:
+                return [tuple(times) for times in tide_tables[date]]
+    return scraper.missing_tide_times()
+
+
+def parse_archived_page(path, task):
+    """Re-parses one archived weather page and its forecasts with the current extractor; runs in a worker process."""
+    sha256, location, fetched_at, tide_times = task
+    return scraper.parse_weather_page(load_page(path, sha256), location, fetched_at, tide_times)
+
+
+def backfill(path, database_file_path, locations=None, start=None, end=None, workers=None):
+    """Re-parses archived weather pages and upserts the records and forecasts into SQLite.
+
+    Pages are parsed across a process pool, then every record and forecast is
+    upserted and the rollup buckets of the rewritten rows are refreshed in one transaction.
+    Returns the number of reports written.
+    """
+    with PageArchive(path) as archive:
+        pages = archive.weather_pages(locations, start, end)
+        logger.info(f"Backfilling {len(pages)} archived weather pages from {path}")
+        if not pages:
+            return 0
+        with metrics.timer('weather_phase_seconds', phase='resolve_tides'):
+            tasks = [
+                (sha256, location, fetched_at, resolve_tide_times(archive, tide_url, fetched_at))
+                for sha256, location, fetched_at, tide_url in pages
+            ]
+
+    with metrics.timer('weather_phase_seconds', phase='parse'):
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(functools.partial(parse_archived_page, path), tasks, chunksize=chunk_size))
+    records = [record for record, _ in results]
+    forecasts = [forecast for _, page_forecasts in results for forecast in page_forecasts]
+
+    for record in records:
+        for field, value in zip(record._fields, record):
+            metrics.increment('weather_fields_total', field=field, status='missing' if value is None else 'found')
+
+    with metrics.timer('weather_phase_seconds', phase='upsert'):
+        if partitions.storage_mode == 'monthly':
+            # Only the month files the re-parsed pages fall in are rewritten
+            written = partitions.store_records(records, forecasts, upsert=True)
+        else:
+            conn = weather_db.connect(database_file_path)
+            try:
+                with conn:
+                    report_ids = weather_db.upsert_weather_records(conn, records)
+                    rollups.refresh_rollups(conn, report_ids=report_ids)
+                    weather_db.upsert_forecast_records(conn, forecasts)
+                weather_db.optimize(conn)
+            finally:
+                conn.close()
+            written = len(report_ids)
+
+    metrics.increment('weather_rows_upserted_total', written, sink='sqlite', table='WeatherReports')
+    metrics.increment('weather_rows_upserted_total', len(forecasts), sink='sqlite', table='forecasts')
+    logger.info(f"Upserted {written} reports and {len(forecasts)} forecasts")
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Re-parse archived pages and upsert the corrected rows into SQLite.')
+    parser.add_argument('--location', action='append', help='location name to backfill; repeat for several (default: all)')
+    parser.add_argument('--start', help="first fetch time to include, e.g. '2024-08-01'")
+    parser.add_argument('--end', help="fetch time to stop before, e.g. '2024-09-01'")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='parser processes')
+    parser.add_argument('--archive', default=archive_dir, help='page archive directory')
+    args = parser.parse_args()
+    if not args.archive:
+        parser.error('no page archive configured; set PAGE_ARCHIVE_DIR or pass --archive')
+
+    try:
+        backfill(args.archive, database_file_path, args.location, args.start, args.end, args.workers)
+    finally:
+        metrics.write()
+
+
+if __name__ == "__main__":
+    main()
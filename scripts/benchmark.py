@@ -0,0 +1,372 @@
+import argparse
+import contextlib
+import functools
+import json
+import logging
+import os
+import platform
+import random
+import re
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from lxml import etree, html
+
+import main as scraper
+import postgres_ingest
+import update_sql_db
+import weather_db
+from http_client import HttpClient
+from locations import load_locations
+from weather_record import field_parsers
+
+
+# Recorded weather and tide pages, listed in manifest.json
+fixtures_dir = os.environ.get('BENCHMARK_FIXTURES_DIR', os.path.join(os.path.dirname(__file__), 'benchmark_fixtures'))
+
+# Ranges the values of a synthetic weather page are varied within, by unit, as (low, high, largest shift);
+# a bare number is a wind speed
+degree_sign = '°'.encode()
+varied_value_ranges = {degree_sign: (-10, 35, 6), b'%': (0, 100, 20), b' mb': (960, 1045, 12), b'': (0, 60, 8)}
+varied_value_pattern = re.compile(rb'>(-?\d+)(' + degree_sign + rb'|%| mb|)<')
+location_name_pattern = re.compile(rb'(id="wr-location-name-id"[^>]*>)[^<]*')
+
+# Timed runs per measurement
+default_repeat = int(os.environ.get('BENCHMARK_REPEAT', 20))
+
+# Rows pushed through the update_sql_db ingest
+default_ingest_rows = int(os.environ.get('BENCHMARK_INGEST_ROWS', 5000))
+
+# Local PostgreSQL for the copy benchmark; it is skipped when unset. Everything runs in
+# one transaction in its own schema and is rolled back, but never point this at production.
+benchmark_database_url = os.environ.get('BENCHMARK_DATABASE_URL')
+
+
+def log(message):
+    # Progress goes to stderr so stdout stays valid JSON
+    print(message, file=sys.stderr)
+
+
+@contextlib.contextmanager
+def quiet():
+    """Silences logging and stdout so the timings measure parsing and ingest, not terminal output."""
+    logging.disable(logging.CRITICAL)
+    try:
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            yield
+    finally:
+        logging.disable(logging.NOTSET)
+
+
+def summarize(samples):
+    """Summarizes a list of durations in seconds as milliseconds."""
+    return {
+        'runs': len(samples),
+        'mean_ms': statistics.mean(samples) * 1000,
+        'median_ms': statistics.median(samples) * 1000,
+        'min_ms': min(samples) * 1000,
+        'max_ms': max(samples) * 1000,
+    }
+
+
+def time_calls(fn, repeat):
+    """Calls fn repeat times and returns the duration of each call."""
+    samples = []
+    with quiet():
+        for _ in range(repeat):
+            start = time.perf_counter()
+            fn()
+            samples.append(time.perf_counter() - start)
+    return samples
+
+
+def vary_weather_page(content, location):
+    """Gives one location its own copy of a synthetic weather page, with its name and shifted readings.
+
+    The shifts are seeded by the location, so every run sees the same pages.
+    """
+    rng = random.Random(location)
+
+    def shift(match):
+        low, high, spread = varied_value_ranges[match.group(2)]
+        value = min(high, max(low, int(match.group(1)) + rng.randint(-spread, spread)))
+        return b'>%d%s<' % (value, match.group(2))
+
+    content = location_name_pattern.sub(lambda match: match.group(1) + location.encode(), content, count=1)
+    return varied_value_pattern.sub(shift, content)
+
+
+def load_fixtures(path=fixtures_dir):
+    """Loads the fixture manifest and the raw bytes of every page it lists.
+
+    A synthetic manifest lists one weather page for every location; each
+    location then gets a copy varied by vary_weather_page.
+    """
+    with open(os.path.join(path, 'manifest.json')) as f:
+        manifest = json.load(f)
+
+    @functools.lru_cache(maxsize=None)
+    def read(name):
+        with open(os.path.join(path, name), 'rb') as f:
+            return f.read()
+
+    weather_pages = {location: read(name) for location, name in manifest['weather'].items()}
+    if manifest.get('vary_weather_values'):
+        weather_pages = {location: vary_weather_page(content, location) for location, content in weather_pages.items()}
+    tide_pages = {url: read(name) for url, name in manifest['tide'].items()}
+    return manifest, weather_pages, tide_pages
+
+
+def record_fixtures(path=fixtures_dir):
+    """Downloads the live weather and tide pages of every registry location as new fixtures."""
+    os.makedirs(path, exist_ok=True)
+    manifest = {
+        'recorded_at': datetime.now(scraper.london_tz).strftime('%Y-%m-%d %H:%M:%S'),
+        'source': 'live BBC weather and tide pages',
+        'tide_date': scraper.today_date,
+        'tide': {},
+        'weather': {},
+    }
+    with HttpClient() as client:
+        for location in load_locations():
+            name = f"weather-{location.location_id}.html"
+            with open(os.path.join(path, name), 'wb') as f:
+                f.write(scraper.fetch_page(client, location.weather_url, location=location.name))
+            manifest['weather'][location.name] = name
+
+            tide_url = location.tide_url
+            if tide_url not in manifest['tide']:
+                name = 'tide.html' if not manifest['tide'] else f"tide-{len(manifest['tide'])}.html"
+                with open(os.path.join(path, name), 'wb') as f:
+                    f.write(scraper.fetch_page(client, tide_url, kind='tide'))
+                manifest['tide'][tide_url] = name
+
+    with open(os.path.join(path, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    log(f"Recorded {len(manifest['weather'])} weather and {len(manifest['tide'])} tide pages to {path}")
+
+
+@functools.lru_cache(maxsize=None)
+def tide_urls():
+    """Maps each registry location name to its tide page URL."""
+    return {location.name: location.tide_url for location in load_locations()}
+
+
+def tide_times_for(location, tide_pages):
+    """Parses today's tide times for a location from the fixtures."""
+    with quiet():
+        return scraper.parse_tide_times(tide_pages[tide_urls()[location]])
+
+
+def bench_page_parsing(weather_pages, tide_pages, repeat):
+    """Times parse_weather_data and parse_weather_page per weather page and parse_all_tide_tables per tide page."""
+    results = {'weather': {}, 'weather_with_forecasts': {}, 'tide': {}}
+    for location, content in weather_pages.items():
+        tide_times = tide_times_for(location, tide_pages)
+        samples = time_calls(
+            lambda: scraper.parse_weather_data(content, location, '2024-01-01 00:00:00', tide_times), repeat)
+        results['weather'][location] = dict(summarize(samples), bytes=len(content))
+        samples = time_calls(
+            lambda: scraper.parse_weather_page(content, location, '2024-01-01 00:00:00', tide_times), repeat)
+        with quiet():
+            _, forecasts = scraper.parse_weather_page(content, location, '2024-01-01 00:00:00', tide_times)
+        results['weather_with_forecasts'][location] = dict(summarize(samples), forecasts=len(forecasts))
+    for url, content in tide_pages.items():
+        samples = time_calls(lambda: scraper.parse_all_tide_tables(content), repeat)
+        results['tide'][url] = dict(summarize(samples), bytes=len(content))
+    return results
+
+
+def bench_field_extraction(weather_pages, repeat):
+    """Times each context lookup and each field's selector, text clean-up and type parsing."""
+    trees = [html.fromstring(content) for content in weather_pages.values()]
+
+    context_samples = {name: [] for name in scraper.weather_contexts}
+    field_samples = {spec.field: [] for spec in scraper.weather_field_specs}
+    found = {spec.field: 0 for spec in scraper.weather_field_specs}
+
+    with quiet():
+        for tree in trees:
+            contexts = {}
+            for name, selector in scraper.weather_contexts.items():
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    contexts[name] = [tree] if selector is None else selector(tree)
+                    context_samples[name].append(time.perf_counter() - start)
+
+            for spec in scraper.weather_field_specs:
+                selector = scraper.compiled_selectors[(spec.context, spec.selector)]
+                parse = field_parsers[spec.field]
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    elem = next((elem for root in contexts[spec.context] for elem in selector(root)), None)
+                    if elem is not None:
+                        value = elem.text.strip()
+                        if spec.suffix and value.endswith(spec.suffix):
+                            value = value[:-len(spec.suffix)]
+                        parse(scraper.map_level(value) if spec.map_level else value)
+                    field_samples[spec.field].append(time.perf_counter() - start)
+                found[spec.field] += elem is not None
+
+    return {
+        'contexts': {name: summarize(samples) for name, samples in context_samples.items()},
+        'fields': {
+            field: dict(summarize(samples), found=found[field], pages=len(trees))
+            for field, samples in field_samples.items()
+        },
+    }
+
+
+def fixture_sheet_rows(weather_pages, tide_pages, row_count):
+    """Builds row_count Google Sheets rows from the fixtures, one sheet per location, with distinct times."""
+    records = {}
+    with quiet():
+        for location, content in weather_pages.items():
+            records[location] = scraper.parse_weather_data(
+                content, location, '2024-01-01 00:00:00', tide_times_for(location, tide_pages))
+
+    rows_by_sheet = {f"Sheet{i + 1}": [] for i in range(len(records))}
+    start = datetime(2024, 1, 1)
+    for n in range(row_count):
+        sheet_index = n % len(records)
+        record = list(records.values())[sheet_index]
+        time_of_search = start + timedelta(minutes=48 * (n // len(records)))
+        rows_by_sheet[f"Sheet{sheet_index + 1}"].append(record._replace(time_of_search=time_of_search).to_sheet_row())
+    return rows_by_sheet
+
+
+def bench_sqlite_ingest(weather_pages, tide_pages, row_count, database_path):
+    """Measures update_sql_db's sheet-row parsing and its ingest into a fresh SQLite database."""
+    rows_by_sheet = fixture_sheet_rows(weather_pages, tide_pages, row_count)
+
+    with quiet():
+        start = time.perf_counter()
+        new_rows = {
+            name: (update_sql_db.rows_to_records(scraper.headers, rows), len(rows) + 1, rows[-1][0] if rows else None)
+            for name, rows in rows_by_sheet.items()
+        }
+        parse_seconds = time.perf_counter() - start
+
+        conn = weather_db.connect(database_path)
+        try:
+            update_sql_db.load_sync_state(conn)
+            start = time.perf_counter()
+            inserted = update_sql_db.ingest_new_rows(conn, new_rows)
+            ingest_seconds = time.perf_counter() - start
+        finally:
+            conn.close()
+
+    return {
+        'rows': row_count,
+        'inserted': inserted,
+        'parse_seconds': parse_seconds,
+        'ingest_seconds': ingest_seconds,
+        'parse_rows_per_second': row_count / parse_seconds,
+        'ingest_rows_per_second': row_count / ingest_seconds,
+        'database_bytes': os.path.getsize(database_path),
+    }
+
+
+def bench_postgres_copy(database_path, database_url):
+    """Times postgres_ingest's table creation and COPY of every table of the SQLite database."""
+    import psycopg2
+
+    sqlite_conn = postgres_ingest.open_sqlite(database_path)
+    pg_conn = psycopg2.connect(database_url)
+    # The inferred columns go to a manifest beside the benchmark database, not the real one in data/
+    manifest_path = postgres_ingest.schema_manifest_path
+    postgres_ingest.schema_manifest_path = os.path.join(
+        os.path.dirname(database_path), 'postgres_schema_manifest.json')
+    results = {}
+    try:
+        sqlite_cursor = sqlite_conn.cursor()
+        pg_cursor = pg_conn.cursor()
+        pg_cursor.execute('CREATE SCHEMA weather_benchmark; SET LOCAL search_path TO weather_benchmark;')
+
+        with quiet():
+            tables = postgres_ingest.list_sqlite_tables(sqlite_cursor)
+            schema = postgres_ingest.load_schema_manifest(sqlite_cursor, tables)
+            for table_name in tables:
+                start = time.perf_counter()
+                postgres_ingest.create_table_in_postgres(sqlite_cursor, pg_cursor, table_name, schema[table_name])
+                stats = postgres_ingest.copy_rows_from_sqlite_to_postgres(
+                    sqlite_cursor, pg_cursor, table_name, f"SELECT * FROM {table_name};")
+                seconds = time.perf_counter() - start
+                results[table_name] = dict(
+                    stats, seconds=seconds, rows_per_second=stats['rows'] / seconds if seconds else None)
+    finally:
+        # Nothing the benchmark created is kept
+        postgres_ingest.schema_manifest_path = manifest_path
+        pg_conn.rollback()
+        pg_conn.close()
+        sqlite_conn.close()
+
+    return results
+
+
+def run_benchmarks(repeat, ingest_rows, database_url):
+    """Runs every benchmark against the fixtures and returns the results as a dict."""
+    manifest, weather_pages, tide_pages = load_fixtures()
+    # Tide tables are looked up by date, so parse them as of the day they were recorded
+    scraper.today_date = manifest['tide_date']
+
+    results = {
+        'run_at': datetime.now(scraper.london_tz).strftime('%Y-%m-%d %H:%M:%S'),
+        'python': platform.python_version(),
+        'lxml': '.'.join(map(str, etree.LXML_VERSION)),
+        'sqlite': sqlite3.sqlite_version,
+        'fixtures': {key: manifest[key] for key in ('recorded_at', 'source', 'tide_date')},
+        'repeat': repeat,
+    }
+
+    log("Timing page parsing")
+    results['page_parsing'] = bench_page_parsing(weather_pages, tide_pages, repeat)
+    log("Timing field extraction")
+    results['field_extraction'] = bench_field_extraction(weather_pages, repeat)
+
+    work_dir = tempfile.mkdtemp(prefix='weather-benchmark-')
+    try:
+        database_path = os.path.join(work_dir, 'nationwide_weather.db')
+        log(f"Timing SQLite ingest of {ingest_rows} rows")
+        results['sqlite_ingest'] = bench_sqlite_ingest(weather_pages, tide_pages, ingest_rows, database_path)
+
+        if database_url:
+            log("Timing SQLite to PostgreSQL copy")
+            results['postgres_copy'] = bench_postgres_copy(database_path, database_url)
+        else:
+            results['postgres_copy'] = {'skipped': 'BENCHMARK_DATABASE_URL is not set'}
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmarks for the scraper and ingest pipeline.")
+    parser.add_argument('--record', action='store_true', help="re-record the fixtures from the live site and exit")
+    parser.add_argument('--output', help="write the JSON results to this file instead of stdout")
+    parser.add_argument('--repeat', type=int, default=default_repeat)
+    parser.add_argument('--ingest-rows', type=int, default=default_ingest_rows)
+    args = parser.parse_args()
+
+    if args.record:
+        record_fixtures()
+        return
+
+    results = run_benchmarks(args.repeat, args.ingest_rows, benchmark_database_url)
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+        log(f"Wrote benchmark results to {args.output}")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+import glob
+import gzip
+import json
+import os
+
+import partitions
+import rollups
+import weather_db
+from instrumentation import get_logger
+from weather_record import ForecastRecord, WeatherRecord
+
+
+logger = get_logger('compact_spool')
+
+# Finished spool segments written by main.py
+spool_dir = os.environ.get('SPOOL_DIR', 'data/spool')
+database_file_path = os.environ.get('DATABASE_FILE_PATH', weather_db.database_file_path)
+
+
+def list_finished_segments(spool_dir, prefix='segment'):
+    """Lists finished spool segments, oldest first; in-progress .tmp files are skipped."""
+    return sorted(glob.glob(os.path.join(spool_dir, f'{prefix}-*.ndjson.gz')))
+
+
+def read_segment(path, record_type=WeatherRecord):
+    """Reads every record from a compressed NDJSON spool segment."""
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        return [record_type.from_json(json.loads(line)) for line in f if line.strip()]
+
+
+def compact_spool(spool_dir, database_file_path):
+    """Bulk-loads all finished spool segments into SQLite in one transaction, then removes them."""
+    segments = list_finished_segments(spool_dir)
+    forecast_segments = list_finished_segments(spool_dir, 'forecast')
+    if not segments and not forecast_segments:
+        logger.info(f"No spool segments to compact in {spool_dir}")
+        return 0
+
+    records = []
+    for segment in segments:
+        segment_records = read_segment(segment)
+        logger.info(f"Read {len(segment_records)} records from {segment}")
+        records.extend(segment_records)
+
+    forecasts = []
+    for segment in forecast_segments:
+        segment_forecasts = read_segment(segment, ForecastRecord)
+        logger.info(f"Read {len(segment_forecasts)} forecasts from {segment}")
+        forecasts.extend(segment_forecasts)
+
+    if partitions.storage_mode == 'monthly':
+        inserted = partitions.store_records(records, forecasts)
+        logger.info(f"Inserted {inserted} of {len(records)} spooled records into {partitions.partition_dir}")
+    else:
+        conn = weather_db.connect(database_file_path)
+        try:
+            with conn:
+                previous_report_id = rollups.last_report_id(conn)
+                inserted = weather_db.insert_weather_records(conn, records)
+                rollups.refresh_rollups(conn, previous_report_id)
+                weather_db.upsert_forecast_records(conn, forecasts)
+            weather_db.optimize(conn)
+        finally:
+            conn.close()
+        logger.info(f"Inserted {inserted} of {len(records)} spooled records into {database_file_path}")
+    logger.info(f"Stored {len(forecasts)} spooled forecasts")
+
+    # Segments are only removed after the commit; re-loading one later is harmless
+    # because records already in WeatherReports are skipped and forecasts are upserted
+    for segment in segments + forecast_segments:
+        os.remove(segment)
+    logger.info(f"Removed {len(segments) + len(forecast_segments)} compacted segments")
+
+    return inserted
+
+
+if __name__ == "__main__":
+    compact_spool(spool_dir, database_file_path)
@@ -0,0 +1,149 @@
+import json
+import os
+import sqlite3
+from datetime import datetime
+from urllib.parse import quote
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import weather_db
+from instrumentation import get_logger
+
+
+logger = get_logger('export_parquet')
+
+database_file_path = os.environ.get('DATABASE_FILE_PATH', weather_db.database_file_path)
+
+# Hive-style layout: <export_dir>/location=<name>/month=<YYYY-MM>/part-0.parquet
+export_dir = os.environ.get('PARQUET_EXPORT_DIR', 'data/parquet/weather_reports')
+manifest_name = '_manifest.json'
+
+time_columns = [
+    'sunset', 'sunrise', 'low_tide_morning_time', 'high_tide_morning_time',
+    'low_tide_evening_time', 'high_tide_evening_time',
+]
+
+# Plain WeatherReports columns after time_of_search; times stay 'HH:MM' text, the rest are numbers
+measure_columns = [
+    column for column, _ in weather_db.report_columns
+    if column != 'time_of_search' and not column.endswith('_id')
+]
+
+export_schema = pa.schema(
+    [('id', pa.int64()), ('time_of_search', pa.timestamp('s'))]
+    + [(column, pa.string()) for column in weather_db.dimension_columns]
+    + [(column, pa.string() if column in time_columns else pa.float64()) for column in measure_columns]
+)
+
+export_query = f'''
+    SELECT
+        r.id, r.time_of_search,
+        {', '.join(f"{alias}.{value_column}" for _, alias, _, value_column in weather_db.dimension_columns.values())},
+        {', '.join(f"r.{column}" for column in measure_columns)}
+    FROM WeatherReports r
+    {' '.join(f"LEFT JOIN {table} {alias} ON r.{id_column} = {alias}.{id_column}"
+              for table, alias, id_column, _ in weather_db.dimension_columns.values())}
+    WHERE r.location_id IN (SELECT location_id FROM Locations WHERE name = ?)
+      AND r.time_of_search BETWEEN ? AND ?
+    ORDER BY r.time_of_search, r.id
+'''
+
+
+def connect_read_only(path):
+    """Opens the weather database read-only, so an export never migrates or writes it."""
+    # query_only rather than mode=ro, so closing removes the WAL files a reader creates; mode=rw
+    # still refuses to create a missing database
+    conn = sqlite3.connect(f"file:{path}?mode=rw", uri=True)
+    conn.execute('PRAGMA query_only = ON')
+    return conn
+
+
+def list_partitions(conn):
+    """Returns every (location, month) partition with its row count and highest report id."""
+    rows = conn.execute('''
+        SELECT loc.name, substr(r.time_of_search, 1, 7) AS month, COUNT(*), MAX(r.id)
+        FROM WeatherReports r
+        JOIN Locations loc ON r.location_id = loc.location_id
+        WHERE r.time_of_search IS NOT NULL
+        GROUP BY loc.name, month
+    ''')
+    return {f"{location}|{month}": {'location': location, 'month': month, 'rows': count, 'max_id': max_id}
+            for location, month, count, max_id in rows}
+
+
+def partition_path(location, month):
+    return os.path.join(export_dir, f"location={quote(location, safe='')}", f"month={month}", 'part-0.parquet')
+
+
+def typed_value(field, value):
+    """Converts a SQLite value to the export column's type; the scraper's 'N/A' becomes null."""
+    if value is None or value == 'N/A' or value == '':
+        return None
+    if pa.types.is_timestamp(field.type):
+        return datetime.strptime(value, '%Y-%m-%d %H:%M:%S')
+    if pa.types.is_floating(field.type):
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            return None
+    return value
+
+
+def write_partition(conn, location, month):
+    """Writes one location-month partition, replacing any previous file atomically."""
+    rows = conn.execute(export_query, (location, f"{month}-01 00:00:00", f"{month}-31 23:59:59")).fetchall()
+    columns = list(zip(*rows)) if rows else [[] for _ in export_schema]
+    arrays = [
+        pa.array([typed_value(field, value) for value in column], type=field.type)
+        for field, column in zip(export_schema, columns)
+    ]
+    table = pa.Table.from_arrays(arrays, schema=export_schema)
+
+    path = partition_path(location, month)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    pq.write_table(table, tmp_path, compression='zstd')
+    os.replace(tmp_path, path)
+    return len(rows)
+
+
+def export_parquet(database_file_path, current_month=None):
+    """Writes new partitions and rewrites the current month, leaving closed months untouched.
+
+    A closed month is also rewritten if its row count or highest id changed
+    since the last export, so late ingests are not lost. Returns the number of
+    partitions written.
+    """
+    current_month = current_month or datetime.now().strftime('%Y-%m')
+    manifest_path = os.path.join(export_dir, manifest_name)
+    try:
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        manifest = {}
+
+    conn = connect_read_only(database_file_path)
+    written = 0
+    try:
+        for key, partition in sorted(list_partitions(conn).items()):
+            exported = manifest.get(key)
+            unchanged = exported == partition and os.path.exists(partition_path(partition['location'], partition['month']))
+            if unchanged and partition['month'] != current_month:
+                continue
+            rows = write_partition(conn, partition['location'], partition['month'])
+            manifest[key] = partition
+            written += 1
+            logger.info(f"Wrote {rows} rows to {partition_path(partition['location'], partition['month'])}")
+    finally:
+        conn.close()
+
+    os.makedirs(export_dir, exist_ok=True)
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    logger.info(f"Exported {written} partitions to {export_dir}")
+    return written
+
+
+if __name__ == "__main__":
+    export_parquet(database_file_path)
@@ -0,0 +1,125 @@
+import os
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from instrumentation import get_logger
+
+
+logger = get_logger('http_client')
+
+# Seconds to wait for a connection, and between bytes of the response
+connect_timeout = float(os.environ.get('HTTP_CONNECT_TIMEOUT', 5))
+read_timeout = float(os.environ.get('HTTP_READ_TIMEOUT', 20))
+
+# Retries after the first attempt on timeouts, connection errors, 429 and 5xx responses
+max_retries = int(os.environ.get('HTTP_MAX_RETRIES', 3))
+backoff_base = float(os.environ.get('HTTP_BACKOFF_BASE', 0.5))
+backoff_max = float(os.environ.get('HTTP_BACKOFF_MAX', 10))
+
+# Token bucket per host: sustained requests per second and burst size
+host_rate = float(os.environ.get('HTTP_HOST_RATE', 4))
+host_burst = int(os.environ.get('HTTP_HOST_BURST', 8))
+
+# Kept-alive connections per host
+pool_size = int(os.environ.get('HTTP_POOL_SIZE', 10))
+
+user_agent = 'nationwide-weather-scraper (+https://github.com/pythonsnatcher/nationwide_weather)'
+
+retry_statuses = {429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """Thread-safe token bucket; acquire() blocks until a token is available."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            # Sleep outside the lock so other hosts' threads are not held up
+            time.sleep(wait)
+
+
+class HttpClient:
+    """One pooled, rate-limited and retrying HTTP client shared by every fetch in a run.
+
+    requests keeps a kept-alive connection pool per host, so TLS handshakes to
+    bbc.com and bbc.co.uk are reused across locations and threads. Every
+    request has connect and read timeouts and is paced by its host's token
+    bucket. Timeouts, connection errors, 429 and 5xx responses are retried with
+    full-jitter exponential backoff; other 4xx responses raise immediately.
+    """
+
+    def __init__(self, metrics=None):
+        self.metrics = metrics
+        self.session = requests.Session()
+        self.session.headers['User-Agent'] = user_agent
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self._buckets = {}
+        self._buckets_lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.session.close()
+
+    def bucket(self, host):
+        with self._buckets_lock:
+            if host not in self._buckets:
+                self._buckets[host] = TokenBucket(host_rate, host_burst)
+            return self._buckets[host]
+
+    def get(self, url, **kwargs):
+        """GETs a URL, retrying transient failures; raises requests.HTTPError on a final error status."""
+        host = urlsplit(url).netloc
+        kwargs.setdefault('timeout', (connect_timeout, read_timeout))
+
+        for attempt in range(max_retries + 1):
+            self.bucket(host).acquire()
+            try:
+                response = self.session.get(url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt == max_retries:
+                    raise
+                reason, delay = type(e).__name__, self.backoff(attempt)
+            else:
+                if response.status_code not in retry_statuses or attempt == max_retries:
+                    response.raise_for_status()
+                    return response
+                reason, delay = f"HTTP {response.status_code}", self.backoff(attempt, response)
+                response.close()
+
+            logger.warning(f"GET {url} failed ({reason}); retry {attempt + 1} of {max_retries} in {delay:.1f}s")
+            if self.metrics:
+                self.metrics.increment('weather_http_retries_total', host=host, reason=reason)
+            time.sleep(delay)
+
+    def backoff(self, attempt, response=None):
+        """Full-jitter exponential backoff, honouring a numeric Retry-After header."""
+        retry_after = response.headers.get('Retry-After') if response is not None else None
+        if retry_after and retry_after.isdigit():
+            return min(float(retry_after), backoff_max)
+        return random.uniform(0, min(backoff_max, backoff_base * 2 ** attempt))
@@ -0,0 +1,123 @@
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+
+# DEBUG shows every extracted field and element; INFO is one line per step
+log_level = os.environ.get('LOG_LEVEL', 'INFO').upper()
+
+# Metrics are written here at the end of a run; a .json path writes JSON, anything else Prometheus text.
+# '{job}' is replaced by the script's job name.
+metrics_path = os.environ.get('METRICS_PATH', 'data/metrics/{job}.prom')
+
+_logging_configured = False
+
+
+def get_logger(name):
+    """Returns a logger, configuring plain message output at LOG_LEVEL on first use."""
+    global _logging_configured
+    if not _logging_configured:
+        logging.basicConfig(level=log_level, format='%(message)s', stream=sys.stdout)
+        _logging_configured = True
+    return logging.getLogger(name)
+
+
+class Metrics:
+    """Thread-safe counters and timings for one run, labelled by phase, location, table, etc.
+
+    Counters only ever go up. Timings keep a count, sum and max per label set,
+    and are exported as Prometheus summaries without quantiles.
+    """
+
+    def __init__(self, job):
+        self.job = job
+        self.started_at = time.time()
+        self._counters = {}
+        self._timings = {}
+        self._lock = threading.Lock()
+
+    def increment(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            count, total, longest = self._timings.get(key, (0, 0.0, 0.0))
+            self._timings[key] = (count + 1, total + seconds, max(longest, seconds))
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """Times the body of a with block, recording it even if the block raises."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def to_json(self):
+        with self._lock:
+            return {
+                'job': self.job,
+                'started_at': self.started_at,
+                'duration_seconds': time.time() - self.started_at,
+                'counters': [
+                    {'name': name, 'labels': dict(labels), 'value': value}
+                    for (name, labels), value in sorted(self._counters.items())
+                ],
+                'timings': [
+                    {'name': name, 'labels': dict(labels), 'count': count, 'sum': total, 'max': longest}
+                    for (name, labels), (count, total, longest) in sorted(self._timings.items())
+                ],
+            }
+
+    def to_prometheus(self):
+        lines = []
+        typed = set()
+
+        def sample(name, labels, value, kind=None):
+            if kind and name not in typed:
+                lines.append(f"# TYPE {name} {kind}")
+                typed.add(name)
+            labels = (('job', self.job),) + labels
+            label_text = ','.join(f'{key}="{escape_label(value)}"' for key, value in labels)
+            lines.append(f"{name}{{{label_text}}} {value}")
+
+        with self._lock:
+            for (name, labels), value in sorted(self._counters.items()):
+                sample(name, labels, value, 'counter')
+            timings = sorted(self._timings.items())
+            for (name, labels), (count, total, _) in timings:
+                if name not in typed:
+                    lines.append(f"# TYPE {name} summary")
+                    typed.add(name)
+                sample(f"{name}_count", labels, count)
+                sample(f"{name}_sum", labels, total)
+            # Samples of one metric must be grouped, so the maxima follow all the summaries
+            for (name, labels), (_, _, longest) in timings:
+                sample(f"{name}_max", labels, longest, 'gauge')
+        sample('weather_run_duration_seconds', (), time.time() - self.started_at, 'gauge')
+        sample('weather_run_finished_timestamp_seconds', (), time.time(), 'gauge')
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path=None):
+        """Writes the metrics file for this run atomically and returns its path."""
+        path = (path or metrics_path).format(job=self.job)
+        content = json.dumps(self.to_json(), indent=2) if path.endswith('.json') else self.to_prometheus()
+
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+        get_logger(__name__).info(f"Wrote metrics to {path}")
+        return path
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
@@ -0,0 +1,68 @@
+import csv
+import hashlib
+import os
+from collections import namedtuple
+
+
+# Every scraped site, one row per location; add rows here rather than editing code
+registry_path = os.environ.get('LOCATIONS_PATH', 'data/locations.csv')
+
+# Run only the locations of one shard: SHARD_INDEX in 0..SHARD_COUNT-1
+shard_index = int(os.environ.get('SHARD_INDEX', 0))
+shard_count = int(os.environ.get('SHARD_COUNT', 1))
+
+tide_url_template = 'https://www.bbc.co.uk/weather/coast-and-sea/tide-tables/{station}'
+
+registry_columns = ['location_id', 'name', 'weather_url', 'tide_station', 'sheet']
+
+Location = namedtuple('Location', ['location_id', 'name', 'weather_url', 'tide_url', 'sheet'])
+
+
+def load_locations(path=registry_path):
+    """Loads the location registry in file order, checking that ids and names are unique."""
+    with open(path, newline='', encoding='utf-8') as f:
+        reader = csv.DictReader(f)
+        missing = [column for column in registry_columns if column not in (reader.fieldnames or [])]
+        if missing:
+            raise ValueError(f"{path} is missing columns: {', '.join(missing)}")
+
+        locations = []
+        for line, row in enumerate(reader, start=2):
+            row = {column: (row[column] or '').strip() for column in registry_columns}
+            if not row['location_id'] or row['location_id'].startswith('#'):
+                continue
+            empty = [column for column in registry_columns if not row[column]]
+            if empty:
+                raise ValueError(f"{path}:{line} has no {', '.join(empty)}")
+            locations.append(Location(
+                row['location_id'], row['name'], row['weather_url'],
+                tide_url_template.format(station=row['tide_station']), row['sheet']))
+
+    for field in ('location_id', 'name'):
+        values = [getattr(location, field) for location in locations]
+        duplicates = sorted({value for value in values if values.count(value) > 1})
+        if duplicates:
+            raise ValueError(f"{path} has duplicate {field}s: {', '.join(duplicates)}")
+
+    return locations
+
+
+def shard_of(location_id, count):
+    """Maps a location id to a shard; stable across processes and runs, unlike hash()."""
+    return int(hashlib.sha1(location_id.encode('utf-8')).hexdigest(), 16) % count
+
+
+def select_shard(locations, index=shard_index, count=shard_count):
+    """Returns the locations that belong to one shard.
+
+    Assignment depends only on the location id, so adding sites to the
+    registry never moves existing ones between shards.
+    """
+    if count < 1 or not 0 <= index < count:
+        raise ValueError(f"Invalid shard {index} of {count}")
+    return [location for location in locations if shard_of(location.location_id, count) == index]
+
+
+def sheet_names(locations):
+    """Returns the distinct sheet targets of the locations, in registry order."""
+    return list(dict.fromkeys(location.sheet for location in locations))
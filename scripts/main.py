@@ -1,14 +1,32 @@
 import requests
-from lxml import html
+from lxml import etree, html
 import csv
+import gzip
+from collections import namedtuple
 import gspread
 from oauth2client.service_account import ServiceAccountCredentials
 import os
-from datetime import datetime
+from datetime import datetime, time as time_of_day, timedelta
 import pytz
 import time
 import os
 import json
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import argparse
+import heapq
+import random
+import signal
+import threading
+
+from http_client import HttpClient
+from instrumentation import Metrics, get_logger
+from locations import load_locations, select_shard
+from page_archive import open_archive
+from weather_record import ForecastRecord, WeatherRecord, headers, parse_datetime, parse_time
+
+
+logger = get_logger('scrape')
+metrics = Metrics('scrape')
 
 
 # get today's date
@@ -17,259 +35,387 @@ today_date = datetime.now().strftime('%Y-%m-%d')
 # Define London timezone
 london_tz = pytz.timezone('Europe/London')
 
-urls = {
-    'London': {
-        'weather': 'https://www.bbc.com/weather/2643743',
-        'tide': 'https://www.bbc.co.uk/weather/coast-and-sea/tide-tables/2/113'
-    },
-    'Birmingham': {
-        'weather': 'https://www.bbc.com/weather/2655603',
-        'tide': 'https://www.bbc.co.uk/weather/coast-and-sea/tide-tables/2/113'
-    },
-    'Manchester': {
-        'weather': 'https://www.bbc.com/weather/2643123',
-        'tide': 'https://www.bbc.co.uk/weather/coast-and-sea/tide-tables/2/113'
-    },
-    'Nottingham': {
-        'weather': 'https://www.bbc.com/weather/2641170',
-        'tide': 'https://www.bbc.co.uk/weather/coast-and-sea/tide-tables/2/113'
-    },
-    'Leeds': {
-        'weather': 'https://www.bbc.com/weather/2644688',
-        'tide': 'https://www.bbc.co.uk/weather/coast-and-sea/tide-tables/2/113'
-    },
-    'Liverpool': {
-        'weather': 'https://www.bbc.co.uk/weather/2644210',
-        'tide': 'https://www.bbc.co.uk/weather/coast-and-sea/tide-tables/2/113'
-    },
-    'Bristol': {
-        'weather': 'https://www.bbc.co.uk/weather/2654675',
-        'tide': 'https://www.bbc.co.uk/weather/coast-and-sea/tide-tables/2/113'
-    },
-    'Newcastle': {
-        'weather': 'https://www.bbc.co.uk/weather/2641673',
-        'tide': 'https://www.bbc.co.uk/weather/coast-and-sea/tide-tables/2/113'
-    },
-    'Southampton': {
-        'weather': 'https://www.bbc.co.uk/weather/2637487',
-        'tide': 'https://www.bbc.co.uk/weather/coast-and-sea/tide-tables/2/113'
-    },
-    'Brighton': {
-        'weather': 'https://www.bbc.co.uk/weather/2654710',
-        'tide': 'https://www.bbc.co.uk/weather/coast-and-sea/tide-tables/2/113'
-    }
+spreadsheet_url = 'https://docs.google.com/spreadsheets/d/1CPudH3miJZRKii6PAN_YBfV2QLdt9CezxUK0YBshsMg/edit?usp=sharing'
+
+# Sheets are cleared back to their headers once they grow past this many rows
+max_sheet_rows = 1000
+
+# Every run's records are also appended here as compressed NDJSON segments for compact_spool.py
+spool_dir = os.environ.get('SPOOL_DIR', 'data/spool')
+
+# Number of pages fetched in parallel; override with SCRAPE_CONCURRENCY
+default_concurrency = 10
+
+# Daemon mode: seconds between scrapes of each location, and the fraction of it added or removed at
+# random so locations drift apart instead of firing together
+daemon_interval = float(os.environ.get('DAEMON_INTERVAL', 48 * 60))
+daemon_jitter = float(os.environ.get('DAEMON_JITTER', 0.1))
+
+# Tide tables cover several days, so they are cached on disk by URL and date
+tide_cache_path = os.environ.get('TIDE_CACHE_PATH', 'data/tide_cache.json')
+
+# Shared prefixes of the weather page selectors, compiled once and resolved once per page
+weather_contexts = {
+    'page': None,
+    'today': etree.XPath('//*[@id="daylink-0"]/div[4]/div[1]/div/div[4]/div'),
+    'hour': etree.XPath(
+        '//*[@id="wr-forecast"]/div[4]/div/div[1]/div[2]/div/div/div/div[2]/ol/li[1]/button'),
+    'environment': etree.XPath('//*[@id="wr-forecast"]/div[4]/div/div[1]/div[4]/div/div[1]'),
+}
+
+FieldSpec = namedtuple('FieldSpec', ['field', 'context', 'selector', 'suffix', 'map_level'])
+
+# One entry per scraped weather field; selectors are relative to their context and
+# each value is parsed to its WeatherRecord field type
+weather_field_specs = [
+    FieldSpec('high_temperature', 'today', 'div[1]/span[2]/span/span[1]', '°', False),
+    FieldSpec('low_temperature', 'today', 'div[2]/span[2]/span/span[1]', '°', False),
+    FieldSpec('current_temperature', 'hour', 'div[1]/div[2]/div[3]/div[2]/div/div/div[2]/span/span[1]', '°', False),
+    FieldSpec('weather_condition', 'hour', 'div[2]/div/span', None, False),
+    FieldSpec('wind_speed', 'hour', 'div[1]/div[2]/div[3]/div[4]/div/span[3]/span/span[1]', None, False),
+    FieldSpec('humidity', 'hour', 'div[2]/div/div/div[1]/dl/dd[1]', '%', False),
+    FieldSpec('pressure', 'hour', 'div[2]/div/div/div[1]/dl/dd[2]', ' mb', False),
+    FieldSpec('visibility', 'hour', 'div[2]/div/div/div[1]/dl/dd[3]', None, False),
+    FieldSpec('location', 'page', '//*[@id="wr-location-name-id"]', None, False),
+    FieldSpec('wind_direction', 'hour', 'div[2]/div/div/div[4]', None, False),
+    FieldSpec('uv_index', 'environment', 'div[2]/span[1]/span[1]/span[2]', None, True),
+    FieldSpec('pollen', 'environment', 'div[2]/span[1]/span[1]/span[2]', None, True),
+    FieldSpec('pollution', 'environment', 'div[2]/span[2]/span[1]/span[2]', None, True),
+    FieldSpec('chance_of_precipitation', 'hour', 'div[1]/div[2]/div[3]/div[3]/div[2]', '%', False),
+    FieldSpec('sunset', 'environment', 'div[1]/span[2]/span[2]', None, False),
+    FieldSpec('sunrise', 'environment', 'div[1]/span[1]/span[2]', None, False),
+]
+
+# Identical selectors share one compiled XPath, so they are also evaluated once per page
+compiled_selectors = {(spec.context, spec.selector): etree.XPath(spec.selector) for spec in weather_field_specs}
+
+# Every day link of the 14-day forecast and every hourly slot; each element is the context of its
+# granularity's forecast_field_specs
+forecast_contexts = {
+    'day': etree.XPath('//*[starts-with(@id, "daylink-")]'),
+    'hour': etree.XPath('//*[@id="wr-forecast"]/div[4]/div/div[1]/div[2]/div/div/div/div[2]/ol/li/button'),
 }
 
+# Day links carry the high and low; hourly slots their time plus the same fields as the first slot
+forecast_field_specs = [
+    FieldSpec('high_temperature', 'day', 'div[4]/div[1]/div/div[4]/div/div[1]/span[2]/span/span[1]', '°', False),
+    FieldSpec('low_temperature', 'day', 'div[4]/div[1]/div/div[4]/div/div[2]/span[2]/span/span[1]', '°', False),
+    FieldSpec('slot_time', 'hour', 'div[1]/div[1]/span', None, False),
+] + [
+    spec._replace(field='temperature' if spec.field == 'current_temperature' else spec.field)
+    for spec in weather_field_specs if spec.context == 'hour'
+]
 
+compiled_forecast_selectors = {spec.selector: etree.XPath(spec.selector) for spec in forecast_field_specs}
+
+
+def fetch_page(client, url, kind='weather', location=''):
+    """Fetches a page through the shared HttpClient and returns its raw content."""
+    try:
+        with metrics.timer('weather_http_request_seconds', kind=kind, location=location):
+            response = client.get(url)
+    except requests.RequestException as e:
+        status = e.response.status_code if e.response is not None else type(e).__name__
+        metrics.increment('weather_http_requests_total', kind=kind, location=location, status=status)
+        raise
+    metrics.increment('weather_http_requests_total', kind=kind, location=location, status=response.status_code)
+    metrics.increment('weather_http_response_bytes_total', len(response.content), kind=kind, location=location)
+    logger.info(f"HTTP GET {url} response status: {response.status_code}")
+    return response.content
 
 
 def map_level(code):
     """Maps single-letter codes to descriptive levels."""
     level = {'L': 'Low', 'M': 'Medium', 'H': 'High'}.get(code, 'Unknown')
-    print(f"Map level: code={code}, level={level}")
+    logger.debug("Map level: code=%s, level=%s", code, level)
     return level
 
 
-def scrape_tide_times(session, location):
-    """Scrapes tide times and heights from the URL based on location."""
-    url = urls[location]['tide']
-    print(f"Scraping tide times for {location} from {url}")
+def scrape_tide_times(client, location):
+    """Returns today's tide times for a registry Location, fetching the tide page only on a cache miss."""
+    url = location.tide_url
+    tide_cache = load_tide_cache()
 
-    response = session.get(url)
-    print(f"HTTP GET response status: {response.status_code}")
+    if today_date not in tide_cache.get(url, {}):
+        logger.info(f"Scraping tide times for {location.name} from {url}")
+        update_tide_cache(tide_cache, url, fetch_page(client, url, kind='tide'))
+        save_tide_cache(tide_cache)
+    else:
+        logger.info(f"Using cached tide times for {location.name} from {url}")
+
+    return cached_tide_times(tide_cache, url)
+
+
+def parse_tide_section(section):
+    """Parses the low and high tide rows of a single day's tide table."""
+    def cell_text(row, cell):
+        elem = section.xpath(f'table/tbody/tr[{row}]/td[{cell}]' + ('/span' if cell == 1 else ''))
+        return elem[0].text.strip() if elem and elem[0].text else "N/A"
 
-    tree = html.fromstring(response.content)
+    # Rows 1 and 3 hold the low tides, rows 2 and 4 the high tides
+    low_tides = (cell_text(1, 1), cell_text(1, 2), cell_text(3, 1), cell_text(3, 2))
+    high_tides = (cell_text(2, 1), cell_text(2, 2), cell_text(4, 1), cell_text(4, 2))
 
-    tide_times = []
+    logger.debug("Low tide morning time: %s, height: %s", low_tides[0], low_tides[1])
+    logger.debug("Low tide evening time: %s, height: %s", low_tides[2], low_tides[3])
+    logger.debug("High tide morning time: %s, height: %s", high_tides[0], high_tides[1])
+    logger.debug("High tide evening time: %s, height: %s", high_tides[2], high_tides[3])
 
-    # Extract low tide times and heights
-    low_tide_xpath_morning_time = f'//*[@id="section-{today_date}"]/table/tbody/tr[1]/td[1]/span'
-    low_tide_xpath_morning_height = f'//*[@id="section-{today_date}"]/table/tbody/tr[1]/td[2]'
-    low_tide_xpath_evening_time = f'//*[@id="section-{today_date}"]/table/tbody/tr[3]/td[1]/span'
-    low_tide_xpath_evening_height = f'//*[@id="section-{today_date}"]/table/tbody/tr[3]/td[2]'
+    return [low_tides, high_tides]
 
-    low_tide_elem_morning_time = tree.xpath(low_tide_xpath_morning_time)
-    low_tide_elem_morning_height = tree.xpath(low_tide_xpath_morning_height)
-    low_tide_elem_evening_time = tree.xpath(low_tide_xpath_evening_time)
-    low_tide_elem_evening_height = tree.xpath(low_tide_xpath_evening_height)
 
-    print(f"Low tide morning time elements: {low_tide_elem_morning_time}")
-    print(f"Low tide morning height elements: {low_tide_elem_morning_height}")
-    print(f"Low tide evening time elements: {low_tide_elem_evening_time}")
-    print(f"Low tide evening height elements: {low_tide_elem_evening_height}")
+def parse_all_tide_tables(content):
+    """Parses every day's tide table on a tide page in one pass, keyed by date."""
+    tree = html.fromstring(content)
 
-    low_tide_time_morning = low_tide_elem_morning_time[0].text.strip() if low_tide_elem_morning_time else "N/A"
-    low_tide_height_morning = low_tide_elem_morning_height[0].text.strip() if low_tide_elem_morning_height else "N/A"
-    low_tide_time_evening = low_tide_elem_evening_time[0].text.strip() if low_tide_elem_evening_time else "N/A"
-    low_tide_height_evening = low_tide_elem_evening_height[0].text.strip() if low_tide_elem_evening_height else "N/A"
+    tide_tables = {}
+    for section in tree.xpath('//*[starts-with(@id, "section-")]'):
+        date = section.get('id')[len('section-'):]
+        try:
+            datetime.strptime(date, '%Y-%m-%d')
+        except ValueError:
+            continue
+        logger.debug("Parsing tide table for %s", date)
+        tide_tables[date] = parse_tide_section(section)
 
-    print(f"Low tide morning time: {low_tide_time_morning}, height: {low_tide_height_morning}")
-    print(f"Low tide evening time: {low_tide_time_evening}, height: {low_tide_height_evening}")
+    return tide_tables
 
-    tide_times.append((low_tide_time_morning, low_tide_height_morning, low_tide_time_evening, low_tide_height_evening))
 
-    # Extract high tide times and heights
-    high_tide_xpath_morning_time = f'//*[@id="section-{today_date}"]/table/tbody/tr[2]/td[1]/span'
-    high_tide_xpath_morning_height = f'//*[@id="section-{today_date}"]/table/tbody/tr[2]/td[2]'
-    high_tide_xpath_evening_time = f'//*[@id="section-{today_date}"]/table/tbody/tr[4]/td[1]/span'
-    high_tide_xpath_evening_height = f'//*[@id="section-{today_date}"]/table/tbody/tr[4]/td[2]'
+def parse_tide_times(content):
+    """Parses today's tide times and heights out of a downloaded tide page."""
+    return parse_all_tide_tables(content).get(today_date, missing_tide_times())
 
-    high_tide_elem_morning_time = tree.xpath(high_tide_xpath_morning_time)
-    high_tide_elem_morning_height = tree.xpath(high_tide_xpath_morning_height)
-    high_tide_elem_evening_time = tree.xpath(high_tide_xpath_evening_time)
-    high_tide_elem_evening_height = tree.xpath(high_tide_xpath_evening_height)
 
-    print(f"High tide morning time elements: {high_tide_elem_morning_time}")
-    print(f"High tide morning height elements: {high_tide_elem_morning_height}")
-    print(f"High tide evening time elements: {high_tide_elem_evening_time}")
-    print(f"High tide evening height elements: {high_tide_elem_evening_height}")
+def missing_tide_times():
+    """Tide times placeholder for a day the tide page does not cover."""
+    return [("N/A", "N/A", "N/A", "N/A"), ("N/A", "N/A", "N/A", "N/A")]
+
+
+def load_tide_cache():
+    """Loads the on-disk tide cache, a dict of tide URL -> date -> tide times."""
+    try:
+        with open(tide_cache_path) as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
 
-    high_tide_time_morning = high_tide_elem_morning_time[0].text.strip() if high_tide_elem_morning_time else "N/A"
-    high_tide_height_morning = high_tide_elem_morning_height[0].text.strip() if high_tide_elem_morning_height else "N/A"
-    high_tide_time_evening = high_tide_elem_evening_time[0].text.strip() if high_tide_elem_evening_time else "N/A"
-    high_tide_height_evening = high_tide_elem_evening_height[0].text.strip() if high_tide_elem_evening_height else "N/A"
+def save_tide_cache(tide_cache):
+    """Writes the tide cache to disk, dropping days that have already passed."""
+    for url in tide_cache:
+        tide_cache[url] = {date: times for date, times in tide_cache[url].items() if date >= today_date}
 
-    print(f"High tide morning time: {high_tide_time_morning}, height: {high_tide_height_morning}")
-    print(f"High tide evening time: {high_tide_time_evening}, height: {high_tide_height_evening}")
+    os.makedirs(os.path.dirname(tide_cache_path) or '.', exist_ok=True)
+    tmp_path = f"{tide_cache_path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(tide_cache, f)
+    os.replace(tmp_path, tide_cache_path)
+    logger.info(f"Saved tide cache to {tide_cache_path}")
 
-    tide_times.append(
-        (high_tide_time_morning, high_tide_height_morning, high_tide_time_evening, high_tide_height_evening))
 
-    return tide_times
+def update_tide_cache(tide_cache, url, content):
+    """Stores every day's tide table from a downloaded tide page in the cache."""
+    tide_cache.setdefault(url, {}).update(parse_all_tide_tables(content))
+
+
+def cached_tide_times(tide_cache, url):
+    """Looks up today's tide times for a tide URL in the cache."""
+    return [tuple(times) for times in tide_cache.get(url, {}).get(today_date, missing_tide_times())]
 
 
 def convert_to_datetime(time_str):
     """Converts a string time format into datetime format."""
     try:
         dt = datetime.strptime(time_str, '%H:%M')
-        print(f"Converted time string '{time_str}' to datetime object {dt}")
+        logger.debug("Converted time string '%s' to datetime object %s", time_str, dt)
         return dt
     except ValueError:
-        print(f"Failed to convert time string '{time_str}'")
+        logger.warning(f"Failed to convert time string '{time_str}'")
         return "N/A"
 
 
-def get_weather_data(session, location, time_of_search):
-    """Fetches weather data from the URL based on location and returns it as a dictionary."""
-    url = urls[location]['weather']
-    print(f"Fetching weather data for {location} from {url}")
+def get_weather_data(client, location, time_of_search):
+    """Fetches and parses the weather and tide pages of a registry Location into a WeatherRecord."""
+    url = location.weather_url
+    logger.info(f"Fetching weather data for {location.name} from {url}")
 
-    response = session.get(url)
-    print(f"HTTP GET response status: {response.status_code}")
-
-    tree = html.fromstring(response.content)
-
-    # Helper function to extract and clean data
-    def extract_and_clean(xpath, elem_index=0, suffix=None, convert_to_float=False):
-        elem = tree.xpath(xpath)
-        if elem:
-            text = elem[elem_index].text.strip()
-            if suffix:
-                text = text[:-len(suffix)]
-            print(f"Extracted text '{text}' from xpath '{xpath}'")
-            return float(text) if convert_to_float else text
-        print(f"No elements found for xpath '{xpath}'")
-        return "N/A"
+    content = fetch_page(client, url, location=location.name)
 
     # Fetch tide times dynamically
-    tide_times = scrape_tide_times(session, location)
-
-    weather_data = {
-        'Time of Search': time_of_search,
-        'High Temperature(°C)': extract_and_clean(
-            '//*[@id="daylink-0"]/div[4]/div[1]/div/div[4]/div/div[1]/span[2]/span/span[1]', suffix='°',
-            convert_to_float=True),
-        'Low Temperature(°C)': extract_and_clean(
-            '//*[@id="daylink-0"]/div[4]/div[1]/div/div[4]/div/div[2]/span[2]/span/span[1]', suffix='°',
-            convert_to_float=True),
-        'Current Temperature(°C)': extract_and_clean(
-            '//*[@id="wr-forecast"]/div[4]/div/div[1]/div[2]/div/div/div/div[2]/ol/li[1]/button/div[1]/div[2]/div[3]/div[2]/div/div/div[2]/span/span[1]',
-            suffix='°', convert_to_float=True),
-        'Weather Condition': extract_and_clean(
-            '//*[@id="wr-forecast"]/div[4]/div/div[1]/div[2]/div/div/div/div[2]/ol/li[1]/button/div[2]/div/span'),
-        'Wind Speed(mph)': extract_and_clean(
-            '//*[@id="wr-forecast"]/div[4]/div/div[1]/div[2]/div/div/div/div[2]/ol/li[1]/button/div[1]/div[2]/div[3]/div[4]/div/span[3]/span/span[1]'),
-        'Humidity(%)': extract_and_clean(
-            '//*[@id="wr-forecast"]/div[4]/div/div[1]/div[2]/div/div/div/div[2]/ol/li[1]/button/div[2]/div/div/div[1]/dl/dd[1]',
-            suffix='%', convert_to_float=True),
-        'Pressure(mb)': extract_and_clean(
-            '//*[@id="wr-forecast"]/div[4]/div/div[1]/div[2]/div/div/div/div[2]/ol/li[1]/button/div[2]/div/div/div[1]/dl/dd[2]',
-            suffix=' mb'),
-        'Visibility': extract_and_clean(
-            '//*[@id="wr-forecast"]/div[4]/div/div[1]/div[2]/div/div/div/div[2]/ol/li[1]/button/div[2]/div/div/div[1]/dl/dd[3]'),
-        'Location': extract_and_clean('//*[@id="wr-location-name-id"]'),
-        'Wind Direction': extract_and_clean(
-            '//*[@id="wr-forecast"]/div[4]/div/div[1]/div[2]/div/div/div/div[2]/ol/li[1]/button/div[2]/div/div/div[4]'),
-        'UV Index': map_level(extract_and_clean(
-            '//*[@id="wr-forecast"]/div[4]/div/div[1]/div[4]/div/div[1]/div[2]/span[1]/span[1]/span[2]')),
-        'Pollen': map_level(extract_and_clean(
-            '//*[@id="wr-forecast"]/div[4]/div/div[1]/div[4]/div/div[1]/div[2]/span[1]/span[1]/span[2]')),
-        'Pollution': map_level(extract_and_clean(
-            '//*[@id="wr-forecast"]/div[4]/div/div[1]/div[4]/div/div[1]/div[2]/span[2]/span[1]/span[2]')),
-        'Chance of Precipitation(%)': extract_and_clean(
-            '//*[@id="wr-forecast"]/div[4]/div/div[1]/div[2]/div/div/div/div[2]/ol/li[1]/button/div[1]/div[2]/div[3]/div[3]/div[2]',
-            suffix='%', convert_to_float=True),
-        'Sunset': extract_and_clean(
-            '//*[@id="wr-forecast"]/div[4]/div/div[1]/div[4]/div/div[1]/div[1]/span[2]/span[2]'),
-        'Sunrise': extract_and_clean(
-            '//*[@id="wr-forecast"]/div[4]/div/div[1]/div[4]/div/div[1]/div[1]/span[1]/span[2]'),
-        'Low Tide Morning Time': tide_times[0][0],
-        'Low Tide Morning Height(M)': tide_times[0][1],
-        'High Tide Morning Time': tide_times[1][0],
-        'High Tide Morning Height(M)': tide_times[1][1],
-        'Low Tide Evening Time': tide_times[0][2],
-        'Low Tide Evening Height(M)': tide_times[0][3],
-        'High Tide Evening Time': tide_times[1][2],
-        'High Tide Evening Height(M)': tide_times[1][3],
-
+    tide_times = scrape_tide_times(client, location)
+
+    return parse_weather_data(content, location.name, time_of_search, tide_times)
+
+
+def parse_weather_data(content, location, time_of_search, tide_times):
+    """Parses a downloaded weather page plus its tide times into a WeatherRecord."""
+    return weather_record_from_tree(html.fromstring(content), location, time_of_search, tide_times)
+
+
+def parse_weather_page(content, location, time_of_search, tide_times):
+    """Parses a weather page once into its WeatherRecord and every ForecastRecord on it."""
+    tree = html.fromstring(content)
+    record = weather_record_from_tree(tree, location, time_of_search, tide_times)
+    # Forecasts are stored under the page's location name, like the report
+    forecasts = extract_forecasts(tree, record.location or location, time_of_search)
+    for granularity in ('day', 'hour'):
+        metrics.increment('weather_forecasts_total', sum(f.granularity == granularity for f in forecasts),
+                          location=location, granularity=granularity)
+    return record, forecasts
+
+
+def weather_record_from_tree(tree, location, time_of_search, tide_times):
+    """Builds the WeatherRecord of a parsed weather page and counts which of its fields were found.
+
+    A level field (UV index, pollen, pollution) missing from the page is
+    recorded as 'Unknown', the level map_level gives an unrecognised code.
+    """
+    values = {'time_of_search': time_of_search}
+    values.update(extract_weather_fields(tree))
+    values.update({
+        'low_tide_morning_time': tide_times[0][0],
+        'low_tide_morning_height': tide_times[0][1],
+        'high_tide_morning_time': tide_times[1][0],
+        'high_tide_morning_height': tide_times[1][1],
+        'low_tide_evening_time': tide_times[0][2],
+        'low_tide_evening_height': tide_times[0][3],
+        'high_tide_evening_time': tide_times[1][2],
+        'high_tide_evening_height': tide_times[1][3],
+    })
+    record = WeatherRecord.from_values(values)
+
+    # A field that is missing on every page usually means its XPath stopped matching
+    for field, value in zip(record._fields, record):
+        metrics.increment('weather_fields_total', field=field, location=location,
+                          status='missing' if value is None else 'found')
+    record = record._replace(**{
+        spec.field: map_level(None) for spec in weather_field_specs
+        if spec.map_level and getattr(record, spec.field) is None
+    })
+
+    logger.debug("Weather data for %s: %s", location, record)
+
+    return record
+
+
+def extract_weather_fields(tree):
+    """Extracts the raw text of every field in weather_field_specs from a parsed weather page."""
+    contexts = {
+        name: [tree] if selector is None else selector(tree)
+        for name, selector in weather_contexts.items()
     }
 
-    print(f"Weather data for {location}: {weather_data}")
-
-    return weather_data
+    matches = {}
+    for key, selector in compiled_selectors.items():
+        context, _ = key
+        matches[key] = next((elem for root in contexts[context] for elem in selector(root)), None)
+
+    return {spec.field: spec_value(spec, matches[(spec.context, spec.selector)]) for spec in weather_field_specs}
+
+
+def spec_value(spec, elem):
+    """Returns the text of a FieldSpec's matched element, with its suffix removed, or None if nothing matched."""
+    if elem is None:
+        logger.debug("No elements found for %s (%s: '%s')", spec.field, spec.context, spec.selector)
+        return None
+    value = (elem.text or '').strip()
+    if spec.suffix and value.endswith(spec.suffix):
+        value = value[:-len(spec.suffix)]
+    logger.debug("Extracted text '%s' for %s", value, spec.field)
+    return map_level(value) if spec.map_level else value
+
+
+def extract_forecast_fields(context, elem):
+    """Extracts the raw text of the forecast_field_specs of one day link or hourly slot."""
+    fields = {}
+    for spec in forecast_field_specs:
+        if spec.context == context:
+            fields[spec.field] = spec_value(spec, next(iter(compiled_forecast_selectors[spec.selector](elem)), None))
+    return fields
+
+
+def extract_forecasts(tree, location, time_of_search):
+    """Extracts every day link and hourly slot of a parsed weather page as ForecastRecords.
+
+    Day links are dated by their daylink-<n> offset from the issue date. Hourly
+    slots only show a time, so their date moves to the next day whenever the
+    time goes backwards, starting from the hour the page was fetched in.
+    """
+    issued_at = parse_datetime(time_of_search)
+    if issued_at is None:
+        return []
+
+    forecasts = []
+    for elem in forecast_contexts['day'](tree):
+        offset = elem.get('id')[len('daylink-'):]
+        if not offset.isdigit():
+            continue
+        values = extract_forecast_fields('day', elem)
+        target_day = issued_at.date() + timedelta(days=int(offset))
+        values.update(location=location, issued_at=issued_at, granularity='day',
+                      target_time=datetime.combine(target_day, time_of_day()))
+        forecasts.append(ForecastRecord.from_values(values))
+
+    target_day, previous_time = issued_at.date(), issued_at.time().replace(minute=0, second=0)
+    for elem in forecast_contexts['hour'](tree):
+        values = extract_forecast_fields('hour', elem)
+        slot_time = parse_time(values.pop('slot_time'))
+        if slot_time is None:
+            continue
+        if slot_time < previous_time:
+            target_day += timedelta(days=1)
+        previous_time = slot_time
+        values.update(location=location, issued_at=issued_at, granularity='hour',
+                      target_time=datetime.combine(target_day, slot_time))
+        forecasts.append(ForecastRecord.from_values(values))
+
+    return forecasts
 
 
 def list_worksheets(client, spreadsheet_url):
     """List all worksheet names in the Google Sheets document."""
-    print(f"Listing worksheets for spreadsheet URL: {spreadsheet_url}")
+    logger.info(f"Listing worksheets for spreadsheet URL: {spreadsheet_url}")
     spreadsheet = client.open_by_url(spreadsheet_url)
     worksheets = spreadsheet.worksheets()
     for worksheet in worksheets:
-        print(f"Worksheet title: {worksheet.title}")
+        logger.info(f"Worksheet title: {worksheet.title}")
 
 
-def write_to_google_sheets(data, sheet_name, headers):
-    """Writes data to a specified Google Sheets sheet."""
+def authorize_sheets_client():
+    """Loads the service account credentials and returns an authorized gspread client."""
     # Setup Google Sheets API credentials
     scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
 
-    # JSON credentials directly in the script
-    # creds_dict = {
-          
-    #     }
-    # token updated jan 2025
-
-    # creds = ServiceAccountCredentials.from_json_keyfile_dict(creds_dict, scope)
-    # print("Google Sheets API credentials loaded")
-
     # Get credentials from environment variable
     creds_json = os.environ.get('GOOGLE_CREDENTIALS')
     if not creds_json:
         raise ValueError("GOOGLE_CREDENTIALS environment variable not found")
-    
+
     creds_dict = json.loads(creds_json)
     creds = ServiceAccountCredentials.from_json_keyfile_dict(creds_dict, scope)
-    print("Google Sheets API credentials loaded")
+    logger.info("Google Sheets API credentials loaded")
 
     client = gspread.authorize(creds)
-    print("Authorized Google Sheets client")
+    logger.info("Authorized Google Sheets client")
+    return client
+
+
+def count_sheets_call(call):
+    metrics.increment('weather_sheets_api_calls_total', call=call)
+
+
+def write_to_google_sheets(data, sheet_name, headers, client=None):
+    """Writes data to a specified Google Sheets sheet."""
+    if client is None:
+        client = authorize_sheets_client()
 
     # Open the Google Sheet and select the worksheet
-    spreadsheet = client.open_by_url(
-        'https://docs.google.com/spreadsheets/d/1CPudH3miJZRKii6PAN_YBfV2QLdt9CezxUK0YBshsMg/edit?usp=sharing')
+    count_sheets_call('open_by_url')
+    spreadsheet = client.open_by_url(spreadsheet_url)
+    count_sheets_call('worksheet')
     worksheet = spreadsheet.worksheet(sheet_name)
 
-    print(f"Selected worksheet: {sheet_name}")
+    logger.info(f"Selected worksheet: {sheet_name}")
 
     # # Clear existing content
     # worksheet.clear()
@@ -277,18 +423,22 @@ def write_to_google_sheets(data, sheet_name, headers):
 
     # Check if headers are already present
 
+    count_sheets_call('get_all_values')
     existing_values = worksheet.get_all_values()
     # If sheet has more than 1000 rows
-    if len(existing_values) > 1000:
-        print(f"Sheet {sheet_name} has exceeded 1000 rows. Clearing and preserving headers...")
+    if len(existing_values) > max_sheet_rows:
+        logger.info(f"Sheet {sheet_name} has exceeded 1000 rows. Clearing and preserving headers...")
+        count_sheets_call('clear')
         worksheet.clear()
+        count_sheets_call('append_row')
         worksheet.append_row(headers)
-        print("Headers rewritten successfully")
+        logger.info("Headers rewritten successfully")
     elif not existing_values or existing_values[0] != headers:
+        count_sheets_call('append_row')
         worksheet.append_row(headers)
-        print(f"Appended headers: {headers}")
+        logger.info(f"Appended headers: {headers}")
     else:
-        print("Headers already exist; not appending headers.")
+        logger.info("Headers already exist; not appending headers.")
 
 
     # -------------------------------------------------------------
@@ -303,122 +453,389 @@ def write_to_google_sheets(data, sheet_name, headers):
         
 
     # Append data
-    for row in data:
-        worksheet.append_row(row)
-        print(f"Appended row data: {row}")
-
-
-def get_sheet_name(location):
-    sheet_names = {
-        'London': 'Sheet1',
-        'Birmingham': 'Sheet2',
-        'Manchester': 'Sheet3',
-        'Nottingham': 'Sheet4',
-        'Leeds': 'Sheet5',
-        'Liverpool': 'Sheet6',
-        'Bristol': 'Sheet7',
-        'Newcastle': 'Sheet8',
-        'Southampton': 'Sheet9',
-        'Brighton': 'Sheet10'
-    }
+    count_sheets_call('append_rows')
+    worksheet.append_rows([list(row) for row in data])
+    logger.debug("Appended row data: %s", data)
+
+
+def sheet_cell(value):
+    """Builds appendCells cell data that stores a value as is, like valueInputOption RAW."""
+    if isinstance(value, bool):
+        return {'userEnteredValue': {'boolValue': value}}
+    if isinstance(value, (int, float)):
+        return {'userEnteredValue': {'numberValue': value}}
+    return {'userEnteredValue': {'stringValue': str(value)}}
+
+
+class BatchedSheetsWriter:
+    """Appends rows for many worksheets with as few Sheets API calls as possible.
+
+    Holds one opened spreadsheet and caches each worksheet's id and whether it
+    has headers. Rows are sent as appendCells requests, which the Sheets API
+    places after the last row at write time, so overlapping writers (shards,
+    the daemon and the scheduled run) never overwrite each other's rows. A
+    write costs one batched read of the row counts, an optional batched clear
+    and a single batch_update.
+    """
+
+    def __init__(self, client, url, headers):
+        count_sheets_call('open_by_url')
+        self.spreadsheet = client.open_by_url(url)
+        self.headers = list(headers)
+        self.sheet_ids = None
+        self.sheet_state = {}
+        logger.info(f"Opened spreadsheet for batched writes: {url}")
+
+    def sheet_id(self, name):
+        if self.sheet_ids is None:
+            count_sheets_call('worksheets')
+            self.sheet_ids = {worksheet.title: worksheet.id for worksheet in self.spreadsheet.worksheets()}
+        if name not in self.sheet_ids:
+            raise gspread.WorksheetNotFound(name)
+        return self.sheet_ids[name]
+
+    def read_row_counts(self, sheet_names):
+        """Reads every worksheet's row count, and the header row of those not yet cached, in one request."""
+        unseen = [name for name in sheet_names if name not in self.sheet_state]
+        ranges = [f"'{name}'!A:A" for name in sheet_names] + [f"'{name}'!1:1" for name in unseen]
+        count_sheets_call('values_batch_get')
+        value_ranges = self.spreadsheet.values_batch_get(ranges).get('valueRanges', [])
+
+        row_counts = {
+            name: len(value_range.get('values', [])) for name, value_range in zip(sheet_names, value_ranges)
+        }
+        for name, value_range in zip(unseen, value_ranges[len(sheet_names):]):
+            self.sheet_state[name] = {'has_headers': value_range.get('values', [[]])[0] == self.headers}
+            logger.debug("Sheet %s: %s", name, self.sheet_state[name])
+        return row_counts
+
+    def write(self, rows_by_sheet):
+        """Appends each worksheet's rows, adding headers and trimming full sheets as needed."""
+        rows_by_sheet = {name: rows for name, rows in rows_by_sheet.items() if rows}
+        if not rows_by_sheet:
+            return
+
+        row_counts = self.read_row_counts(list(rows_by_sheet))
+
+        clear_ranges = []
+        requests = []
+        for name, rows in rows_by_sheet.items():
+            state = self.sheet_state[name]
+            values = [list(row) for row in rows]
+
+            # If sheet has more than max_sheet_rows rows, clear it and start again from the headers
+            if row_counts[name] > max_sheet_rows:
+                logger.info(f"Sheet {name} has exceeded {max_sheet_rows} rows. Clearing and preserving headers...")
+                clear_ranges.append(f"'{name}'")
+                state['has_headers'] = False
+
+            if not state['has_headers']:
+                values.insert(0, self.headers)
+                logger.info(f"Appending headers to {name}")
+
+            requests.append({'appendCells': {
+                'sheetId': self.sheet_id(name),
+                'rows': [{'values': [sheet_cell(value) for value in row]} for row in values],
+                'fields': 'userEnteredValue',
+            }})
+            state['has_headers'] = True
+
+        try:
+            if clear_ranges:
+                count_sheets_call('values_batch_clear')
+                self.spreadsheet.values_batch_clear(body={'ranges': clear_ranges})
+            count_sheets_call('batch_update')
+            self.spreadsheet.batch_update({'requests': requests})
+        except Exception:
+            # The cached state may no longer match the sheets, so re-read it next time
+            self.sheet_state.clear()
+            self.sheet_ids = None
+            raise
+
+        for name, rows in rows_by_sheet.items():
+            metrics.increment('weather_sheet_rows_written_total', len(rows), sheet=name)
+        logger.info(f"Appended {sum(len(request['appendCells']['rows']) for request in requests)} rows "
+                    f"to {len(requests)} sheets in one batch")
+
+
+def write_spool_segment(records, prefix='segment'):
+    """Appends a run's records to the local spool as one compressed NDJSON segment.
+
+    The segment is written under a .tmp name and renamed once complete, so
+    compaction only ever sees finished segments. WeatherRecords go to
+    segment-* files and ForecastRecords to forecast-* files.
+    """
+    if not records:
+        return None
+
+    os.makedirs(spool_dir, exist_ok=True)
+    name = f"{prefix}-{datetime.now(pytz.utc).strftime('%Y%m%dT%H%M%S%f')}-{os.getpid()}.ndjson.gz"
+    path = os.path.join(spool_dir, name)
+    tmp_path = f"{path}.tmp"
+
+    with gzip.open(tmp_path, 'wt', encoding='utf-8') as f:
+        for record in records:
+            f.write(json.dumps(record.to_json(), ensure_ascii=False) + '\n')
+    os.replace(tmp_path, path)
+
+    logger.info(f"Spooled {len(records)} records to {path}")
+    return path
+
+
+def fetch_all_pages(client, locations, max_workers, archive=None):
+    """Fetches every registry Location's weather page and any uncached tide pages in parallel.
+
+    Each distinct tide URL is downloaded at most once per run and only when the
+    tide cache has no table for today. Returns a dict of pages and tide times per
+    location name and a dict of errors per location name, so a failed page only
+    drops the locations that depend on it. Every fetch shares the client's
+    per-host connection pools and rate limits. When an archive is given, every
+    fetched page is stored in it for backfill.py.
+    """
+    by_name = {location.name: location for location in locations}
+
+    tide_cache = load_tide_cache()
+    tide_urls = {location.tide_url for location in locations}
+    stale_tide_urls = sorted(url for url in tide_urls if today_date not in tide_cache.get(url, {}))
+    logger.info(f"Tide pages to fetch: {len(stale_tide_urls)} of {len(tide_urls)}")
+
+    pages = {location.name: {} for location in locations}
+    errors = {}
+    tide_errors = {}
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        futures = {
+            executor.submit(fetch_page, client, location.weather_url, 'weather', location.name): ('weather', location.name)
+            for location in locations
+        }
+        futures.update({executor.submit(fetch_page, client, url, 'tide'): ('tide', url) for url in stale_tide_urls})
+
+        for future in as_completed(futures):
+            kind, key = futures[future]
+            try:
+                content = future.result()
+            except Exception as e:
+                logger.error(f"Failed to fetch {kind} page for {key}: {e}")
+                if kind == 'weather':
+                    errors[key] = e
+                else:
+                    tide_errors[key] = e
+                continue
+
+            # Use the time the weather page arrived as the time of search
+            fetched_at = datetime.now(london_tz).strftime('%Y-%m-%d %H:%M:%S')
+            if kind == 'weather':
+                pages[key]['weather'] = content
+                pages[key]['time_of_search'] = fetched_at
+            else:
+                update_tide_cache(tide_cache, key, content)
+
+            if archive is not None:
+                try:
+                    if kind == 'weather':
+                        location = by_name[key]
+                        archive.store(content, kind, location.weather_url, fetched_at, location=key, tide_url=location.tide_url)
+                    else:
+                        archive.store(content, kind, key, fetched_at)
+                except Exception as e:
+                    logger.error(f"Failed to archive {kind} page for {key}: {e}")
+
+    if stale_tide_urls:
+        save_tide_cache(tide_cache)
 
-    if location in sheet_names:
-        return sheet_names[location]
-    else:
-        raise ValueError(f"Unknown location: {location}")
+    for location in locations:
+        if location.tide_url in tide_errors:
+            errors.setdefault(location.name, tide_errors[location.tide_url])
+        elif location.name not in errors:
+            pages[location.name]['tide_times'] = cached_tide_times(tide_cache, location.tide_url)
+
+    return {location: page for location, page in pages.items() if location not in errors}, errors
 
 
 def main():
-    # Setup Google Sheets client
-    scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
-    
-    # creds_dict = creds_dict = {
-         
-    #     }
-    # # creds updated jan 2025
+    parser = argparse.ArgumentParser(description='Scrape weather and tide pages into Google Sheets and the local spool.')
+    parser.add_argument('--daemon', action='store_true',
+                        help='keep running, scraping each location every DAEMON_INTERVAL seconds until SIGTERM')
+    args = parser.parse_args()
 
-    
-    # creds = ServiceAccountCredentials.from_json_keyfile_dict(creds_dict, scope)
-    # print("Google Sheets API credentials loaded")
+    try:
+        if args.daemon:
+            run_daemon()
+        else:
+            run()
+    finally:
+        metrics.write()
 
-    # Get credentials from environment variable
-    creds_json = os.environ.get('GOOGLE_CREDENTIALS')
-    if not creds_json:
-        raise ValueError("GOOGLE_CREDENTIALS environment variable not found")
-    
-    creds_dict = json.loads(creds_json)
-    creds = ServiceAccountCredentials.from_json_keyfile_dict(creds_dict, scope)
-    print("Google Sheets API credentials loaded")
 
-    client = gspread.authorize(creds)
-    print("Authorized Google Sheets client")
-
-    # List worksheet names
-    list_worksheets(client,
-                    'https://docs.google.com/spreadsheets/d/1CPudH3miJZRKii6PAN_YBfV2QLdt9CezxUK0YBshsMg/edit?usp=sharing')
-
-    locations = [
-        'London', 'Birmingham', 'Manchester', 'Nottingham', 'Leeds',
-        'Liverpool', 'Bristol', 'Newcastle', 'Southampton', 'Brighton'
-    ]
-
-    headers = [
-        'Time of Search', 'High Temperature(°C)', 'Low Temperature(°C)', 'Current Temperature(°C)',
-        'Weather Condition', 'Wind Speed(mph)', 'Humidity(%)', 'Pressure(mb)', 'Visibility', 'Location',
-        'Wind Direction', 'UV Index', 'Pollen', 'Pollution', 'Chance of Precipitation(%)',
-        'Sunset', 'Sunrise', 'Low Tide Morning Time', 'Low Tide Morning Height(M)',
-        'High Tide Morning Time', 'High Tide Morning Height(M)', 'Low Tide Evening Time',
-        'Low Tide Evening Height(M)', 'High Tide Evening Time', 'High Tide Evening Height(M)'
-    ]
+def run():
+    # Setup Google Sheets client
+    with metrics.timer('weather_phase_seconds', phase='authorize'):
+        sheets_client = authorize_sheets_client()
+        sheets_writer = BatchedSheetsWriter(sheets_client, spreadsheet_url, headers)
+
+    locations = load_shard()
+
+    archive = open_archive()
+    try:
+        with HttpClient(metrics) as http_client:
+            scrape_locations(http_client, sheets_client, sheets_writer, locations, archive)
+        if archive is not None:
+            archive.prune()
+    finally:
+        if archive is not None:
+            archive.close()
+
+
+def load_shard():
+    """Loads the registry Locations of this shard."""
+    # Each shard (see SHARD_INDEX and SHARD_COUNT) scrapes its own fixed slice of the registry
+    registry = load_locations()
+    locations = select_shard(registry)
+    logger.info(f"Scraping {len(locations)} of {len(registry)} registry locations")
+    return locations
+
+
+def scrape_locations(http_client, sheets_client, sheets_writer, locations, archive=None):
+    """Fetches, parses, spools and writes to Sheets one batch of Locations."""
+    concurrency = int(os.environ.get('SCRAPE_CONCURRENCY', default_concurrency))
+    logger.info(f"Fetching pages for {len(locations)} locations with concurrency {concurrency}")
+
+    with metrics.timer('weather_phase_seconds', phase='fetch'):
+        pages, fetch_errors = fetch_all_pages(http_client, locations, concurrency, archive)
+
+    records = []
+    forecasts = []
+    rows_by_sheet = {}
+    with metrics.timer('weather_phase_seconds', phase='parse'):
+        for location in locations:
+            name = location.name
+            if name in fetch_errors:
+                logger.warning(f"Skipping {name}: {fetch_errors[name]}")
+                metrics.increment('weather_location_errors_total', location=name, stage='fetch')
+                continue
+
+            try:
+                page = pages[name]
+                logger.info(f"Parsing data for location: {name} at {page['time_of_search']}")
+
+                with metrics.timer('weather_parse_seconds', location=name):
+                    record, page_forecasts = parse_weather_page(
+                        page['weather'], name, page['time_of_search'], page['tide_times'])
+                records.append(record)
+                forecasts.extend(page_forecasts)
+
+                # Prepare data for Google Sheets
+                tide_times_data = [record.to_sheet_row()]
+
+                logger.debug("Prepared data for Google Sheets: %s", tide_times_data)
+
+                # Each location's rows go to the sheet named in the registry
+                rows_by_sheet.setdefault(location.sheet, []).extend(tide_times_data)
+            except Exception as e:
+                logger.error(f"Error processing {name}: {e}")
+                metrics.increment('weather_location_errors_total', location=name, stage='parse')
+
+    # Spool locally first so the rows survive a failed or trimmed Sheets write
+    with metrics.timer('weather_phase_seconds', phase='spool'):
+        try:
+            write_spool_segment(records)
+            metrics.increment('weather_spooled_records_total', len(records))
+            write_spool_segment(forecasts, prefix='forecast')
+            metrics.increment('weather_spooled_forecasts_total', len(forecasts))
+        except Exception as e:
+            logger.error(f"Error writing spool segment: {e}")
+
+    logger.info(f"Writing data to sheets: {sorted(rows_by_sheet)}")
+    with metrics.timer('weather_phase_seconds', phase='sheets'):
+        try:
+            sheets_writer.write(rows_by_sheet)
+        except Exception as e:
+            # Fall back to writing sheet by sheet so one bad sheet doesn't lose every row
+            logger.warning(f"Batched write failed ({e}); writing sheets one at a time")
+            for sheet_name, rows in rows_by_sheet.items():
+                try:
+                    write_to_google_sheets(rows, sheet_name, headers, sheets_client)
+                    metrics.increment('weather_sheet_rows_written_total', len(rows), sheet=sheet_name)
+                except Exception as e:
+                    logger.error(f"Error writing to {sheet_name}: {e}")
+                    metrics.increment('weather_sheet_errors_total', sheet=sheet_name)
+
+
+def run_daemon():
+    """Scrapes each location on its own jittered schedule in one long-lived process.
+
+    The HTTP connection pools, the authorized Sheets client and the opened
+    spreadsheet stay warm between cycles. gspread refreshes the OAuth token
+    only when it has expired. Locations start at random offsets within one
+    interval and are each rescheduled every DAEMON_INTERVAL seconds, plus or
+    minus DAEMON_JITTER of it, so their requests spread out instead of
+    arriving together. Locations that fall due together are scraped as one
+    batch. SIGTERM and SIGINT finish the batch in progress, then exit.
+    """
+    global today_date
+
+    stop = threading.Event()
+
+    def request_stop(signum, frame):
+        logger.info(f"Received signal {signum}; stopping after the current batch")
+        stop.set()
+
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
+
+    with metrics.timer('weather_phase_seconds', phase='authorize'):
+        sheets_client = authorize_sheets_client()
+        sheets_writer = BatchedSheetsWriter(sheets_client, spreadsheet_url, headers)
+
+    locations = load_shard()
+    schedule = [(time.monotonic() + random.uniform(0, daemon_interval), i) for i in range(len(locations))]
+    heapq.heapify(schedule)
+    logger.info(f"Daemon scheduling {len(locations)} locations every {daemon_interval:.0f}s "
+                f"(jitter {daemon_jitter:.0%})")
+
+    archive = open_archive()
+    try:
+        with HttpClient(metrics) as http_client:
+            while schedule and not stop.is_set():
+                # Sleep until the next location is due, waking early on a stop signal
+                if stop.wait(max(0.0, schedule[0][0] - time.monotonic())):
+                    break
+
+                now = time.monotonic()
+                due = []
+                while schedule and schedule[0][0] <= now:
+                    due.append(heapq.heappop(schedule)[1])
+
+                # The process outlives the day, so tide tables are looked up for the current date
+                today_date = datetime.now().strftime('%Y-%m-%d')
+                # Another writer may have trimmed a sheet, so re-read each sheet's header row
+                sheets_writer.sheet_state.clear()
+
+                try:
+                    with metrics.timer('weather_daemon_batch_seconds'):
+                        scrape_locations(http_client, sheets_client, sheets_writer,
+                                         [locations[i] for i in due], archive)
+                except Exception as e:
+                    logger.error(f"Scrape batch failed: {e}")
+                    metrics.increment('weather_daemon_batch_errors_total')
+                metrics.increment('weather_daemon_batches_total')
+
+                for i in due:
+                    interval = daemon_interval * (1 + random.uniform(-daemon_jitter, daemon_jitter))
+                    heapq.heappush(schedule, (max(now + interval, time.monotonic()), i))
+
+                try:
+                    metrics.write()
+                except OSError as e:
+                    logger.error(f"Failed to write metrics: {e}")
+
+        if archive is not None:
+            archive.prune()
+    finally:
+        if archive is not None:
+            archive.close()
+    logger.info("Daemon stopped")
 
-    for location in locations:
-        # Use the current time for the weather data
-        time_of_search = datetime.now(london_tz).strftime('%Y-%m-%d %H:%M:%S')
-        print(f"Fetching data for location: {location} at {time_of_search}")
-
-        with requests.Session() as session:
-            # Get weather data
-            weather_data = get_weather_data(session, location, time_of_search)
-
-            # Get tide times
-            tide_times = scrape_tide_times(session, location)
-
-            # Prepare data for Google Sheets
-            tide_times_data = [(
-                weather_data['Time of Search'],
-                weather_data['High Temperature(°C)'],
-                weather_data['Low Temperature(°C)'],
-                weather_data['Current Temperature(°C)'],
-                weather_data['Weather Condition'],
-                weather_data['Wind Speed(mph)'],
-                weather_data['Humidity(%)'],
-                weather_data['Pressure(mb)'],
-                weather_data['Visibility'],
-                weather_data['Location'],
-                weather_data['Wind Direction'],
-                weather_data['UV Index'],
-                weather_data['Pollen'],
-                weather_data['Pollution'],
-                weather_data['Chance of Precipitation(%)'],
-                weather_data['Sunset'],
-                weather_data['Sunrise'],
-                weather_data['Low Tide Morning Time'],
-                weather_data['Low Tide Morning Height(M)'],
-                weather_data['High Tide Morning Time'],
-                weather_data['High Tide Morning Height(M)'],
-                weather_data['Low Tide Evening Time'],
-                weather_data['Low Tide Evening Height(M)'],
-                weather_data['High Tide Evening Time'],
-                weather_data['High Tide Evening Height(M)']
-            )]
-
-            print(f"Prepared data for Google Sheets: {tide_times_data}")
-
-            # Get the appropriate sheet name based on the location
-            sheet_name = get_sheet_name(location)
-
-            print(f"Writing data to sheet: {sheet_name}")
-            write_to_google_sheets(tide_times_data, sheet_name, headers)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,178 @@
+import gzip
+import hashlib
+import os
+import sqlite3
+from datetime import datetime, timedelta
+
+from instrumentation import get_logger
+
+
+logger = get_logger('page_archive')
+
+# Every fetched page is kept here so it can be re-parsed later; set to '' to disable archiving
+archive_dir = os.environ.get('PAGE_ARCHIVE_DIR', 'data/archive')
+
+# Fetches older than this many days are dropped, then the oldest pages until the objects fit in max_bytes
+max_age_days = float(os.environ.get('PAGE_ARCHIVE_MAX_AGE_DAYS', '30'))
+max_bytes = int(os.environ.get('PAGE_ARCHIVE_MAX_BYTES', str(1024 ** 3)))
+
+
+class PageArchive:
+    """Compressed, content-addressed store of fetched pages with an index by location and fetch time.
+
+    Page bodies live under objects/<first two hex digits>/<sha256>.html.gz, so
+    a page that has not changed between fetches (most tide pages) is stored
+    once. index.db records every fetch: kind, location, URL, fetch time and,
+    for weather pages, the tide page URL used alongside it. prune() keeps the
+    archive within max_age_days and max_bytes.
+    """
+
+    def __init__(self, path=archive_dir):
+        self.path = path
+        os.makedirs(os.path.join(path, 'objects'), exist_ok=True)
+        index_path = os.path.join(path, 'index.db')
+        if not os.path.exists(index_path):
+            # An archive restored from a cache can be evicted, so a lost archive shows up in the logs
+            logger.warning(f"No page archive index at {index_path}, starting a new archive")
+        self.conn = sqlite3.connect(index_path, timeout=30, check_same_thread=False)
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS ArchivedPages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                sha256 TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                location TEXT,
+                url TEXT NOT NULL,
+                fetched_at TEXT NOT NULL,
+                tide_url TEXT,
+                bytes INTEGER NOT NULL
+            )
+        ''')
+        self.conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_archived_pages_location_time
+            ON ArchivedPages (kind, location, fetched_at)
+        ''')
+        self.conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_archived_pages_url_time
+            ON ArchivedPages (url, fetched_at)
+        ''')
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def store(self, content, kind, url, fetched_at, location=None, tide_url=None):
+        """Stores a fetched page and indexes the fetch; returns the page's sha256."""
+        sha256 = hashlib.sha256(content).hexdigest()
+        path = object_path(self.path, sha256)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with gzip.open(tmp_path, 'wb') as f:
+                f.write(content)
+            os.replace(tmp_path, path)
+
+        with self.conn:
+            self.conn.execute('''
+                INSERT INTO ArchivedPages (sha256, kind, location, url, fetched_at, tide_url, bytes)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', (sha256, kind, location, url, fetched_at, tide_url, len(content)))
+        return sha256
+
+    def weather_pages(self, locations=None, start=None, end=None):
+        """Returns (sha256, location, fetched_at, tide_url) of archived weather pages, oldest first.
+
+        start is inclusive and end exclusive, compared against fetched_at.
+        """
+        where = ["kind = 'weather'"]
+        params = []
+        if locations:
+            where.append(f"location IN ({', '.join('?' for _ in locations)})")
+            params += list(locations)
+        if start:
+            where.append('fetched_at >= ?')
+            params.append(start)
+        if end:
+            where.append('fetched_at < ?')
+            params.append(end)
+        return self.conn.execute(f'''
+            SELECT sha256, location, fetched_at, tide_url FROM ArchivedPages
+            WHERE {' AND '.join(where)}
+            ORDER BY fetched_at, id
+        ''', params).fetchall()
+
+    def tide_pages(self, url, until):
+        """Returns the distinct tide pages fetched from url up to a time, newest first."""
+        rows = self.conn.execute('''
+            SELECT sha256, MAX(fetched_at) AS last_fetched FROM ArchivedPages
+            WHERE kind = 'tide' AND url = ? AND fetched_at <= ?
+            GROUP BY sha256
+            ORDER BY last_fetched DESC
+        ''', (url, until))
+        return [sha256 for sha256, _ in rows]
+
+    def prune(self, max_age_days=max_age_days, max_bytes=max_bytes):
+        """Drops fetches older than max_age_days, then the least recently fetched pages beyond max_bytes.
+
+        Objects no fetch refers to any more are deleted; returns their number.
+        """
+        cutoff = (datetime.now() - timedelta(days=max_age_days)).strftime('%Y-%m-%d %H:%M:%S')
+        with self.conn:
+            self.conn.execute('DELETE FROM ArchivedPages WHERE fetched_at < ?', (cutoff,))
+
+        # Newest first, so the pages kept are the most recently fetched ones
+        pages = self.conn.execute('''
+            SELECT sha256 FROM ArchivedPages GROUP BY sha256 ORDER BY MAX(fetched_at) DESC
+        ''').fetchall()
+        kept = set()
+        total = 0
+        evicted = []
+        for (sha256,) in pages:
+            try:
+                size = os.path.getsize(object_path(self.path, sha256))
+            except FileNotFoundError:
+                size = 0
+            if evicted or total + size > max_bytes:
+                evicted.append((sha256,))
+            else:
+                kept.add(sha256)
+                total += size
+        if evicted:
+            with self.conn:
+                self.conn.executemany('DELETE FROM ArchivedPages WHERE sha256 = ?', evicted)
+
+        deleted = 0
+        objects_dir = os.path.join(self.path, 'objects')
+        for prefix in os.listdir(objects_dir):
+            for name in os.listdir(os.path.join(objects_dir, prefix)):
+                if name.removesuffix('.html.gz') not in kept:
+                    os.remove(os.path.join(objects_dir, prefix, name))
+                    deleted += 1
+        logger.info(f"Pruned {deleted} archived pages, keeping {len(kept)} ({total} bytes)")
+        return deleted
+
+
+def object_path(path, sha256):
+    return os.path.join(path, 'objects', sha256[:2], f"{sha256}.html.gz")
+
+
+def load_page(path, sha256):
+    """Reads an archived page body by its sha256."""
+    with gzip.open(object_path(path, sha256), 'rb') as f:
+        return f.read()
+
+
+def open_archive():
+    """Opens the configured archive, or returns None when archiving is disabled or unavailable."""
+    if not archive_dir:
+        return None
+    try:
+        return PageArchive(archive_dir)
+    except (OSError, sqlite3.Error) as e:
+        logger.error(f"Page archive disabled: {e}")
+        return None
@@ -0,0 +1,242 @@
+import os
+import sqlite3
+from datetime import datetime
+
+import rollups
+import weather_db
+from instrumentation import get_logger
+
+
+logger = get_logger('partitions')
+
+# 'single' keeps everything in data/nationwide_weather.db; 'monthly' writes reports, forecasts and
+# rollups to one SQLite file per month next to a shared dimension database
+storage_mode = os.environ.get('STORAGE_MODE', 'single')
+
+partition_dir = os.environ.get('PARTITION_DIR', 'data/partitions')
+
+dimensions_name = 'dimensions.db'
+
+# The dimension database is attached to every month file under this name
+dimensions_schema = 'dims'
+
+# SQLite attaches at most 10 databases to a connection
+max_attached = 10
+
+# Tables of a month file that open_range exposes as views across the attached months
+month_tables = ['WeatherReports', *weather_db.forecast_tables.values()] + [
+    f'{prefix}{table}' for prefix, _, _, _ in rollups.rollup_granularities
+    for table in ('WeatherRollups', 'ConditionCounts')
+]
+
+
+def dimensions_path(directory=partition_dir):
+    return os.path.join(directory, dimensions_name)
+
+
+def month_path(directory, month):
+    return os.path.join(directory, f"weather-{month}.db")
+
+
+def month_of(value):
+    """Returns the 'YYYY-MM' partition of a datetime or a 'YYYY-MM-DD ...' string."""
+    return value.strftime('%Y-%m') if isinstance(value, datetime) else str(value)[:7]
+
+
+def current_month():
+    return datetime.now().strftime('%Y-%m')
+
+
+def months_between(start, end):
+    """Lists the 'YYYY-MM' months from start's month to end's month, inclusive."""
+    year, month = map(int, month_of(start).split('-'))
+    last = month_of(end)
+    months = []
+    while f"{year:04d}-{month:02d}" <= last:
+        months.append(f"{year:04d}-{month:02d}")
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return months
+
+
+def create_database(path):
+    """Opens a partition file, setting the page size and WAL while it is still empty."""
+    conn = sqlite3.connect(path)
+    if conn.execute('PRAGMA page_count').fetchone()[0] == 0:
+        conn.execute(f'PRAGMA page_size = {weather_db.page_size}')
+        conn.execute('PRAGMA journal_mode = WAL')
+    conn.execute('PRAGMA synchronous = NORMAL')
+    return conn
+
+
+def connect_dimensions(directory=partition_dir):
+    """Opens the shared dimension database, which also keeps update_sql_db's sheet watermarks."""
+    os.makedirs(directory, exist_ok=True)
+    conn = create_database(dimensions_path(directory))
+    weather_db.create_dimension_schema(conn)
+    for statement in weather_db.dimension_indexes():
+        conn.execute(statement)
+    return conn
+
+
+def connect_month(directory, month):
+    """Opens one month's file for writing, with the dimension database attached.
+
+    The month file has no dimension tables, so unqualified reads of and inserts
+    into them resolve to the attached dimension database, and the functions in
+    weather_db and rollups work unchanged.
+    """
+    connect_dimensions(directory).close()
+    conn = create_database(month_path(directory, month))
+    conn.execute(f'ATTACH DATABASE ? AS {dimensions_schema}', (dimensions_path(directory),))
+    weather_db.create_report_schema(conn)
+    for statement in weather_db.report_indexes:
+        conn.execute(statement)
+    rollups.create_rollup_tables(conn)
+    return conn
+
+
+def store_records(records, forecasts=(), upsert=False, directory=partition_dir):
+    """Writes WeatherRecords and ForecastRecords to their months' files, one transaction per month.
+
+    Only the files of the months the records fall in are written, normally just
+    the current one. Records already stored are skipped, or overwritten when
+    upsert is set. Returns the number of reports written.
+    """
+    records_by_month = {}
+    for record in records:
+        if record.time_of_search is None:
+            logger.warning(f"Skipping a report for {record.location} with no time of search")
+            continue
+        records_by_month.setdefault(month_of(record.time_of_search), []).append(record)
+    forecasts_by_month = {}
+    for forecast in forecasts:
+        forecasts_by_month.setdefault(month_of(forecast.issued_at), []).append(forecast)
+
+    written = 0
+    for month in sorted(set(records_by_month) | set(forecasts_by_month)):
+        conn = connect_month(directory, month)
+        try:
+            with conn:
+                month_records = records_by_month.get(month, [])
+                if upsert:
+                    report_ids = weather_db.upsert_weather_records(conn, month_records)
+                    rollups.refresh_rollups(conn, report_ids=report_ids)
+                    month_written = len(report_ids)
+                else:
+                    previous_report_id = rollups.last_report_id(conn)
+                    month_written = weather_db.insert_weather_records(conn, month_records)
+                    rollups.refresh_rollups(conn, previous_report_id)
+                weather_db.upsert_forecast_records(conn, forecasts_by_month.get(month, []))
+            weather_db.optimize(conn)
+        finally:
+            conn.close()
+        logger.info(f"Wrote {month_written} reports to {month_path(directory, month)}")
+        written += month_written
+    return written
+
+
+def stored_months(start, end, directory=partition_dir):
+    """Lists the months from start to end that have a month file."""
+    return [month for month in months_between(start, end) if os.path.exists(month_path(directory, month))]
+
+
+def open_range(start, end, directory=partition_dir):
+    """Opens the dimension database read-only with only the months from start to end attached.
+
+    Each month table (WeatherReports, the forecast and rollup tables) is a
+    TEMP view over the attached months, so queries written for the single
+    database run unchanged. Report ids are only unique within a month.
+    Closed months are attached as immutable, which skips locking. At most
+    max_attached months can be open at once; see query_range for longer
+    ranges.
+    """
+    months = stored_months(start, end, directory)
+    if not months:
+        raise ValueError(f"No months are stored between {start} and {end} in {directory}")
+    if len(months) > max_attached:
+        raise ValueError(f"{start} to {end} spans {len(months)} months; at most {max_attached} can be attached")
+
+    # query_only (set once the views exist) rather than mode=ro, so closing removes the WAL files a reader creates
+    conn = sqlite3.connect(f"file:{os.path.abspath(dimensions_path(directory))}", uri=True)
+    this_month = current_month()
+    for month in months:
+        path = os.path.abspath(month_path(directory, month))
+        uri = f"file:{path}" if month >= this_month else f"file:{path}?immutable=1"
+        conn.execute(f"ATTACH DATABASE ? AS m{month.replace('-', '_')}", (uri,))
+
+    for table in month_tables:
+        selects = ' UNION ALL '.join(f"SELECT * FROM m{month.replace('-', '_')}.{table}" for month in months)
+        conn.execute(f'CREATE TEMP VIEW {table} AS {selects}')
+    conn.execute('PRAGMA query_only = ON')
+    return conn
+
+
+def query_range(sql, params, start, end, directory=partition_dir):
+    """Runs a row-level query over the months from start to end, attaching a batch of months at a time.
+
+    Rows are yielded batch by batch in month order, so aggregates and ORDER BY
+    only apply within a batch.
+    """
+    months = stored_months(start, end, directory)
+    for i in range(0, len(months), max_attached):
+        batch = months[i:i + max_attached]
+        conn = open_range(batch[0], batch[-1], directory)
+        try:
+            yield from conn.execute(sql, params)
+        finally:
+            conn.close()
+
+
+def split_database(source_path, directory=partition_dir):
+    """Copies a single-file database into the monthly layout, keeping every id.
+
+    Dimension rows go to the shared database, and each month's reports and
+    forecasts to its month file, where the rollups are rebuilt.
+    """
+    # Migrating the source first removes duplicate dimension values
+    weather_db.connect(source_path).close()
+
+    conn = connect_dimensions(directory)
+    try:
+        conn.execute('ATTACH DATABASE ? AS source', (source_path,))
+        with conn:
+            for table, _, _, _ in weather_db.dimension_tables:
+                conn.execute(f'INSERT OR IGNORE INTO main.{table} SELECT * FROM source.{table}')
+        months = [month for (month,) in conn.execute('''
+            SELECT DISTINCT substr(time_of_search, 1, 7) FROM source.WeatherReports WHERE time_of_search IS NOT NULL
+            UNION
+            SELECT DISTINCT substr(issued_at, 1, 7) FROM source.DailyForecasts
+            UNION
+            SELECT DISTINCT substr(issued_at, 1, 7) FROM source.HourlyForecasts
+            ORDER BY 1
+        ''')]
+    finally:
+        conn.close()
+
+    report_columns = ', '.join(['id'] + [column for column, _ in weather_db.report_columns])
+    forecast_columns = ', '.join(['id'] + [column for column, _ in weather_db.forecast_columns])
+    for month in months:
+        conn = connect_month(directory, month)
+        try:
+            conn.execute('ATTACH DATABASE ? AS source', (source_path,))
+            with conn:
+                conn.execute(f'''
+                    INSERT OR IGNORE INTO main.WeatherReports ({report_columns})
+                    SELECT {report_columns} FROM source.WeatherReports WHERE substr(time_of_search, 1, 7) = ?
+                ''', (month,))
+                for table in weather_db.forecast_tables.values():
+                    conn.execute(f'''
+                        INSERT OR IGNORE INTO main.{table} ({forecast_columns})
+                        SELECT {forecast_columns} FROM source.{table} WHERE substr(issued_at, 1, 7) = ?
+                    ''', (month,))
+                rollups.refresh_rollups(conn)
+            weather_db.optimize(conn)
+        finally:
+            conn.close()
+        logger.info(f"Split {month} into {month_path(directory, month)}")
+    return months
+
+
+if __name__ == "__main__":
+    # Convert the single-file database into the monthly layout
+    split_database(os.environ.get('DATABASE_FILE_PATH', weather_db.database_file_path))
@@ -0,0 +1,306 @@
+import base64
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import weather_db
+from instrumentation import get_logger
+
+
+logger = get_logger('query_service')
+
+database_file_path = os.environ.get('DATABASE_FILE_PATH', weather_db.database_file_path)
+host = os.environ.get('QUERY_HOST', '127.0.0.1')
+port = int(os.environ.get('QUERY_PORT', 8050))
+
+cache_size = int(os.environ.get('QUERY_CACHE_SIZE', 256))
+cache_ttl = float(os.environ.get('QUERY_CACHE_TTL', 60))
+
+default_page_size = 500
+max_page_size = 5000
+
+# Plain WeatherReports columns that can be projected
+report_columns = ['id'] + [column for column, _ in weather_db.report_columns if not column.endswith('_id')]
+
+default_columns = ['id', 'time_of_search', 'location', 'current_temperature', 'weather_condition']
+
+rollup_tables = {'hourly': 'HourlyWeatherRollups', 'daily': 'DailyWeatherRollups'}
+
+
+class QueryError(ValueError):
+    """A bad request parameter; reported to the client as HTTP 400."""
+
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries also expire after ttl seconds."""
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            stored_at, value = entry
+            if time.monotonic() - stored_at > self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class WeatherQueries:
+    """Filtered, projected and paginated reads of the weather database, with a result cache.
+
+    The cache is cleared whenever another connection commits to the database
+    (SQLite's data_version changes), so an ingest by update_sql_db.py or
+    compact_spool.py is visible on the next request.
+    """
+
+    def __init__(self, path, cache):
+        self.path = path
+        self.cache = cache
+        self._local = threading.local()
+        self._watch_lock = threading.Lock()
+        self._watch_conn = self._connect()
+        self._data_version = self._read_data_version()
+
+    def _connect(self):
+        conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False)
+        conn.execute('PRAGMA query_only = ON')
+        return conn
+
+    def _conn(self):
+        # One read-only connection per server thread
+        if not hasattr(self._local, 'conn'):
+            self._local.conn = self._connect()
+        return self._local.conn
+
+    def _read_data_version(self):
+        return self._watch_conn.execute('PRAGMA data_version').fetchone()[0]
+
+    def invalidate_if_ingested(self):
+        """Clears the cache when the database has been written since the last check."""
+        with self._watch_lock:
+            data_version = self._read_data_version()
+            if data_version != self._data_version:
+                self._data_version = data_version
+                self.cache.clear()
+                logger.info("Database changed; query cache cleared")
+
+    def cached(self, key, compute):
+        self.invalidate_if_ingested()
+        result = self.cache.get(key)
+        if result is None:
+            result = compute()
+            self.cache.put(key, result)
+        return result
+
+    def locations(self):
+        """Returns every location name with its ids."""
+        def compute():
+            rows = self._conn().execute('SELECT name, location_id FROM Locations ORDER BY name, location_id')
+            locations = OrderedDict()
+            for name, location_id in rows:
+                locations.setdefault(name, []).append(location_id)
+            return {'locations': [{'name': name, 'location_ids': ids} for name, ids in locations.items()]}
+        return self.cached(('locations',), compute)
+
+    def _location_ids(self, location):
+        rows = self._conn().execute('SELECT location_id FROM Locations WHERE name = ?', (location,)).fetchall()
+        if not rows:
+            raise QueryError(f"Unknown location: {location}")
+        return [row[0] for row in rows]
+
+    def reports(self, location=None, start=None, end=None, columns=None, limit=default_page_size, cursor=None):
+        """Returns one page of reports ordered by time of search.
+
+        start is inclusive and end exclusive; both compare against the
+        'YYYY-MM-DD HH:MM:SS' time_of_search text, so a date also works. The
+        cursor is the opaque next_cursor of the previous page.
+        """
+        columns = columns or default_columns
+        unknown = [
+            column for column in columns
+            if column not in report_columns and column not in weather_db.dimension_columns
+        ]
+        if unknown:
+            raise QueryError(f"Unknown columns: {', '.join(unknown)}")
+        try:
+            limit = max(1, min(int(limit), max_page_size))
+        except (TypeError, ValueError):
+            raise QueryError("Invalid limit")
+        key = ('reports', location, start, end, tuple(columns), limit, cursor)
+        return self.cached(key, lambda: self._reports(location, start, end, columns, limit, cursor))
+
+    def _reports(self, location, start, end, columns, limit, cursor):
+        select = ['r.id', 'r.time_of_search']
+        joins = []
+        for column in columns:
+            if column in weather_db.dimension_columns:
+                table, alias, id_column, value_column = weather_db.dimension_columns[column]
+                # Only the dimensions that were asked for are joined
+                joins.append(f"LEFT JOIN {table} {alias} ON r.{id_column} = {alias}.{id_column}")
+                select.append(f"{alias}.{value_column}")
+            else:
+                select.append(f"r.{column}")
+
+        where = []
+        params = []
+        if location:
+            location_ids = self._location_ids(location)
+            where.append(f"r.location_id IN ({', '.join('?' for _ in location_ids)})")
+            params += location_ids
+        if start:
+            where.append('r.time_of_search >= ?')
+            params.append(start)
+        if end:
+            where.append('r.time_of_search < ?')
+            params.append(end)
+        if cursor:
+            last_time, last_id = decode_cursor(cursor)
+            where.append('(r.time_of_search, r.id) > (?, ?)')
+            params += [last_time, last_id]
+
+        query = f"SELECT {', '.join(select)} FROM WeatherReports r {' '.join(joins)}"
+        if where:
+            query += f" WHERE {' AND '.join(where)}"
+        query += ' ORDER BY r.time_of_search, r.id LIMIT ?'
+        params.append(limit + 1)
+
+        rows = self._conn().execute(query, params).fetchall()
+        page = rows[:limit]
+        results = [
+            {column: clean_value(value) for column, value in zip(columns, row[2:])}
+            for row in page
+        ]
+        next_cursor = encode_cursor(page[-1][1], page[-1][0]) if len(rows) > limit else None
+        return {'rows': results, 'next_cursor': next_cursor}
+
+    def rollups(self, granularity='daily', location=None, start=None, end=None):
+        """Returns pre-aggregated hourly or daily rollups maintained by rollups.py."""
+        if granularity not in rollup_tables:
+            raise QueryError(f"Unknown granularity: {granularity}")
+        key = ('rollups', granularity, location, start, end)
+        return self.cached(key, lambda: self._rollups(rollup_tables[granularity], location, start, end))
+
+    def _rollups(self, table, location, start, end):
+        where = []
+        params = []
+        if location:
+            location_ids = self._location_ids(location)
+            where.append(f"location_id IN ({', '.join('?' for _ in location_ids)})")
+            params += location_ids
+        if start:
+            where.append('bucket_start >= ?')
+            params.append(start)
+        if end:
+            where.append('bucket_start < ?')
+            params.append(end)
+
+        query = f"SELECT * FROM {table}"
+        if where:
+            query += f" WHERE {' AND '.join(where)}"
+        query += ' ORDER BY bucket_start, location_id'
+
+        try:
+            result = self._conn().execute(query, params)
+        except sqlite3.OperationalError:
+            # No ingest has built the rollups yet
+            return {'rows': []}
+        names = [desc[0] for desc in result.description]
+        return {'rows': [dict(zip(names, row)) for row in result.fetchall()]}
+
+
+def clean_value(value):
+    """Maps the scraper's 'N/A' placeholder to null."""
+    return None if value == 'N/A' else value
+
+
+def encode_cursor(time_of_search, report_id):
+    return base64.urlsafe_b64encode(json.dumps([time_of_search, report_id]).encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        time_of_search, report_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return time_of_search, int(report_id)
+    except (ValueError, TypeError):
+        raise QueryError("Invalid cursor")
+
+
+def make_handler(queries):
+    """Builds the request handler class serving the given WeatherQueries."""
+
+    class QueryHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            request = urlparse(self.path)
+            params = {name: values[-1] for name, values in parse_qs(request.query).items()}
+            try:
+                if request.path == '/reports':
+                    columns = params.get('columns')
+                    body = queries.reports(
+                        location=params.get('location'),
+                        start=params.get('start'),
+                        end=params.get('end'),
+                        columns=columns.split(',') if columns else None,
+                        limit=params.get('limit', default_page_size),
+                        cursor=params.get('cursor'),
+                    )
+                elif request.path == '/rollups':
+                    body = queries.rollups(
+                        granularity=params.get('granularity', 'daily'),
+                        location=params.get('location'),
+                        start=params.get('start'),
+                        end=params.get('end'),
+                    )
+                elif request.path == '/locations':
+                    body = queries.locations()
+                else:
+                    self.send_json(404, {'error': f"Unknown path: {request.path}"})
+                    return
+            except QueryError as e:
+                self.send_json(400, {'error': str(e)})
+                return
+            self.send_json(200, body)
+
+        def send_json(self, status, body):
+            payload = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+    return QueryHandler
+
+
+def main():
+    queries = WeatherQueries(database_file_path, TTLCache(cache_size, cache_ttl))
+    server = ThreadingHTTPServer((host, port), make_handler(queries))
+    logger.info(f"Serving weather queries for {database_file_path} on http://{host}:{port}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+import weather_db
+from instrumentation import get_logger
+
+
+logger = get_logger('rollups')
+
+# Rollup granularities as (table prefix, length of the time_of_search bucket key,
+# bucket start suffix, bucket end suffix)
+rollup_granularities = [
+    ('Hourly', 13, ':00:00', ':59:59'),
+    ('Daily', 10, ' 00:00:00', ' 23:59:59'),
+]
+
+# Numeric WeatherReports columns aggregated into each bucket, as (rollup name, column)
+rollup_measures = [
+    ('temperature', 'current_temperature'),
+    ('humidity', 'humidity'),
+    ('pressure', 'pressure'),
+    ('precipitation_chance', 'chance_of_precipitation'),
+]
+
+
+def numeric(column):
+    """SQL for a column's value when it is a number; the scraper's 'N/A' text becomes NULL."""
+    return f"CASE WHEN typeof({column}) IN ('integer', 'real') THEN {column} END"
+
+
+def create_rollup_tables(conn):
+    """Creates the per-location hourly and daily rollup tables if they do not exist yet."""
+    measure_columns = ''.join(
+        f"min_{name} REAL, max_{name} REAL, mean_{name} REAL, " for name, _ in rollup_measures)
+    for prefix, _, _, _ in rollup_granularities:
+        conn.execute(f'''
+            CREATE TABLE IF NOT EXISTS {prefix}WeatherRollups (
+                location_id INTEGER NOT NULL,
+                bucket_start TEXT NOT NULL,
+                report_count INTEGER NOT NULL,
+                {measure_columns}
+                PRIMARY KEY (location_id, bucket_start)
+            )
+        ''')
+        conn.execute(f'''
+            CREATE TABLE IF NOT EXISTS {prefix}ConditionCounts (
+                location_id INTEGER NOT NULL,
+                bucket_start TEXT NOT NULL,
+                weather_condition_id INTEGER,
+                report_count INTEGER NOT NULL
+            )
+        ''')
+        conn.execute(f'''
+            CREATE INDEX IF NOT EXISTS idx_{prefix.lower()}_condition_counts_bucket
+            ON {prefix}ConditionCounts (location_id, bucket_start)
+        ''')
+
+
+def refresh_rollups(conn, since_report_id=0, report_ids=None):
+    """Recomputes only the buckets touched by WeatherReports rows with ids above since_report_id.
+
+    Each affected (location, bucket) is re-aggregated from WeatherReports with
+    an index range scan, so late or re-ingested rows are always reflected.
+    When the rollups are still empty every bucket is built. Passing report_ids
+    refreshes the buckets of those rows instead, e.g. after rows were updated
+    in place by a backfill. The caller owns the transaction. Returns the
+    number of buckets refreshed per granularity.
+    """
+    create_rollup_tables(conn)
+
+    if report_ids is not None:
+        conn.execute('DROP TABLE IF EXISTS temp.selected_reports')
+        conn.execute('CREATE TEMP TABLE selected_reports (id INTEGER PRIMARY KEY)')
+        conn.executemany('INSERT OR IGNORE INTO selected_reports (id) VALUES (?)',
+                         ((i,) for i in report_ids))
+
+    refreshed = {}
+    for prefix, key_length, start_suffix, end_suffix in rollup_granularities:
+        selection, params = 'id > ?', (since_report_id,)
+        if conn.execute(f'SELECT 1 FROM {prefix}WeatherRollups LIMIT 1').fetchone() is None:
+            params = (0,)
+        elif report_ids is not None:
+            selection, params = 'id IN (SELECT id FROM selected_reports)', ()
+
+        conn.execute('DROP TABLE IF EXISTS temp.affected_buckets')
+        conn.execute(f'''
+            CREATE TEMP TABLE affected_buckets AS
+            SELECT DISTINCT
+                location_id,
+                substr(time_of_search, 1, {key_length}) || '{start_suffix}' AS bucket_start,
+                substr(time_of_search, 1, {key_length}) || '{end_suffix}' AS bucket_end
+            FROM WeatherReports
+            WHERE {selection} AND time_of_search IS NOT NULL
+        ''', params)
+
+        bucket_join = '''
+            FROM affected_buckets b
+            JOIN WeatherReports r
+              ON r.location_id = b.location_id
+             AND r.time_of_search BETWEEN b.bucket_start AND b.bucket_end
+        '''
+        measure_names = ''.join(
+            f", min_{name}, max_{name}, mean_{name}" for name, _ in rollup_measures)
+        measure_values = ''.join(
+            f", MIN({value}), MAX({value}), AVG({value})"
+            for value in (numeric('r.' + column) for _, column in rollup_measures))
+
+        conn.execute(f'''
+            INSERT OR REPLACE INTO {prefix}WeatherRollups
+                (location_id, bucket_start, report_count{measure_names})
+            SELECT b.location_id, b.bucket_start, COUNT(*){measure_values}
+            {bucket_join}
+            GROUP BY b.location_id, b.bucket_start
+        ''')
+
+        conn.execute(f'''
+            DELETE FROM {prefix}ConditionCounts
+            WHERE (location_id, bucket_start) IN (
+                SELECT location_id, bucket_start FROM affected_buckets
+            )
+        ''')
+        conn.execute(f'''
+            INSERT INTO {prefix}ConditionCounts
+                (location_id, bucket_start, weather_condition_id, report_count)
+            SELECT b.location_id, b.bucket_start, r.weather_condition_id, COUNT(*)
+            {bucket_join}
+            GROUP BY b.location_id, b.bucket_start, r.weather_condition_id
+        ''')
+
+        refreshed[prefix] = conn.execute('SELECT COUNT(*) FROM affected_buckets').fetchone()[0]
+        conn.execute('DROP TABLE temp.affected_buckets')
+
+    if report_ids is not None:
+        conn.execute('DROP TABLE temp.selected_reports')
+
+    logger.info(f"Refreshed rollup buckets: {refreshed}")
+    return refreshed
+
+
+def last_report_id(conn):
+    """Returns the highest WeatherReports id, to pass to refresh_rollups after an ingest."""
+    return conn.execute('SELECT COALESCE(MAX(id), 0) FROM WeatherReports').fetchone()[0]
+
+
+if __name__ == "__main__":
+    # Rebuild every bucket from scratch
+    conn = weather_db.connect()
+    with conn:
+        for prefix, _, _, _ in rollup_granularities:
+            conn.execute(f'DROP TABLE IF EXISTS {prefix}WeatherRollups')
+            conn.execute(f'DROP TABLE IF EXISTS {prefix}ConditionCounts')
+        refresh_rollups(conn)
+    conn.close()
@@ -1,295 +1,195 @@
 import gspread
-import pandas as pd
-import sqlite3
 from oauth2client.service_account import ServiceAccountCredentials
 import json  
 import os
 import sys
 
+import partitions
+import rollups
+import weather_db
+from instrumentation import Metrics, get_logger
+from locations import load_locations, sheet_names
+from weather_record import WeatherRecord
 
 
+logger = get_logger('update_sql_db')
+metrics = Metrics('update_sql_db')
 
 
-print(f"Python version: {sys.version}")
-print(f"Working directory: {os.getcwd()}")
-print(f"Available environment variables: {os.environ}")
-
-
-
+def load_sync_state(conn):
+    """Loads each sheet's watermark: the last synced row number and its time of search."""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS SheetSyncState (
+            sheet_name TEXT PRIMARY KEY,
+            last_row INTEGER NOT NULL,
+            last_time_of_search TEXT
+        )
+    ''')
+    rows = conn.execute('SELECT sheet_name, last_row, last_time_of_search FROM SheetSyncState')
+    return {name: (last_row, last_time) for name, last_row, last_time in rows}
+
+
+def save_sync_state(conn, sync_state):
+    """Stores each sheet's watermark."""
+    conn.executemany('''
+        INSERT INTO SheetSyncState (sheet_name, last_row, last_time_of_search)
+        VALUES (?, ?, ?)
+        ON CONFLICT(sheet_name) DO UPDATE SET
+            last_row = excluded.last_row,
+            last_time_of_search = excluded.last_time_of_search
+    ''', [(name, last_row, last_time) for name, (last_row, last_time) in sync_state.items()])
+
+
+def rows_to_records(headers, rows):
+    """Parses raw sheet rows into WeatherRecords, skipping blank and repeated header rows."""
+    records = []
+    for row in rows:
+        if not row or row[:len(headers)] == headers or not row[0]:
+            continue
+        records.append(WeatherRecord.from_sheet_row(headers, row))
+    return records
+
+
+def fetch_new_rows(sheet, worksheet_names, sync_state):
+    """Fetches the rows appended to each worksheet since its watermark.
+
+    Every worksheet's header row and new row range are read in one batched
+    request. The range starts at the last synced row, which must still hold the
+    same time of search; if it doesn't, the sheet was cleared by main.py and is
+    read again from the top. Returns worksheet -> (records, last_row, last_time).
+    """
+    params = {'valueRenderOption': 'UNFORMATTED_VALUE'}
+
+    ranges = []
+    for name in worksheet_names:
+        last_row, _ = sync_state.get(name, (0, None))
+        ranges += [f"'{name}'!1:1", f"'{name}'!A{max(last_row, 2)}:ZZ"]
+    metrics.increment('weather_sheets_api_calls_total', call='values_batch_get')
+    value_ranges = sheet.values_batch_get(ranges, params=params).get('valueRanges', [])
+
+    new_rows = {}
+    for i, name in enumerate(worksheet_names):
+        headers = value_ranges[2 * i].get('values', [[]])[0]
+        rows = value_ranges[2 * i + 1].get('values', [])
+        last_row, last_time = sync_state.get(name, (0, None))
+        start_row = max(last_row, 2)
+
+        if last_row >= 2:
+            if rows and rows[0] and str(rows[0][0]) == str(last_time):
+                # Drop the already-synced watermark row
+                rows = rows[1:]
+                start_row += 1
+            else:
+                logger.warning(f"Watermark row {last_row} of {name} has changed; re-reading the whole sheet")
+                metrics.increment('weather_sheets_api_calls_total', call='values_get')
+                rows = sheet.values_get(f"'{name}'!A2:ZZ", params=params).get('values', [])
+                start_row = 2
+                last_row, last_time = 1, None
+
+        if rows:
+            last_row = start_row + len(rows) - 1
+            last_time = next((row[0] for row in reversed(rows) if row and row[0]), last_time)
+        new_rows[name] = (rows_to_records(headers, rows), last_row, last_time)
+
+    return new_rows
+
+
+def ingest_new_rows(conn, new_rows, dimension_ids=None):
+    """Inserts the records from fetch_new_rows and moves each sheet's watermark, in one transaction.
+
+    In monthly storage conn is the dimension database, which keeps the
+    watermarks; the reports are committed to their month files first, and
+    re-inserting them after a failure before the watermarks move is harmless.
+    """
+    records = []
+    for worksheet_name, (sheet_records, last_row, last_time) in new_rows.items():
+        logger.info(f"Read {len(sheet_records)} new rows from {worksheet_name}")
+        metrics.increment('weather_sheet_rows_read_total', len(sheet_records), sheet=worksheet_name)
+        records.extend(sheet_records)
+
+    sync_state = {name: (last_row, last_time) for name, (_, last_row, last_time) in new_rows.items()}
+    if partitions.storage_mode == 'monthly':
+        inserted = partitions.store_records(records)
+        with conn:
+            save_sync_state(conn, sync_state)
+        metrics.increment('weather_rows_inserted_total', inserted, sink='sqlite', table='WeatherReports')
+        logger.info(f"Inserted {inserted} of {len(records)} rows into {partitions.partition_dir}")
+        return inserted
+
+    # Insert every new report with a single executemany inside one transaction,
+    # moving the watermarks forward in the same transaction
+    with conn:
+        previous_report_id = rollups.last_report_id(conn)
+        inserted = weather_db.insert_weather_records(conn, records, dimension_ids)
+        # Only the hourly/daily buckets touched by the new rows are recomputed
+        rollups.refresh_rollups(conn, previous_report_id)
+        save_sync_state(conn, sync_state)
+    metrics.increment('weather_rows_inserted_total', inserted, sink='sqlite', table='WeatherReports')
+    logger.info(f"Inserted {inserted} of {len(records)} rows into WeatherReports")
+    return inserted
 
 
 # Define the paths
 database_file_path = 'data/nationwide_weather.db'
 spreadsheet_url = 'https://docs.google.com/spreadsheets/d/1CPudH3miJZRKii6PAN_YBfV2QLdt9CezxUK0YBshsMg/edit?usp=sharing'
 
-# Set up Google Sheets credentials
-scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
-try:
-    creds_json = os.environ.get('GOOGLE_CREDENTIALS')
-    if not creds_json:
-        raise ValueError("GOOGLE_CREDENTIALS environment variable not found")
-    
-    creds_dict = json.loads(creds_json)
-    creds = ServiceAccountCredentials.from_json_keyfile_dict(creds_dict, scope)
-    print("Google Sheets API credentials loaded")
-except Exception as e:
-    print(f"Error loading credentials: {e}")
-    raise
-client = gspread.authorize(creds)
-sheet = client.open_by_url(spreadsheet_url)
-
-# Connect to the SQLite database
-conn = sqlite3.connect(database_file_path)
-cursor = conn.cursor()
-
-# Process each sheet in the spreadsheet
-for sheet_index in range(1, 11):  # Adjust this range based on the number of sheets you have
-    worksheet_name = f'Sheet{sheet_index}'
-    print(f"Processing {worksheet_name}...")
-
-    # Read the data from the Google Sheets
-    worksheet = sheet.worksheet(worksheet_name)
-    data = worksheet.get_all_records()
-    df = pd.DataFrame(data)
-
-    for _, row in df.iterrows():
-        # For each table, check if the record exists and insert if not
-        location = row['Location']
-        cursor.execute('''
-            SELECT location_id FROM Locations WHERE name = ?
-        ''', (location,))
-        location_id = cursor.fetchone()
-        if location_id is None:
-            cursor.execute('''
-                INSERT INTO Locations (name)
-                VALUES (?)
-            ''', (location,))
-            location_id = cursor.lastrowid
-        else:
-            location_id = location_id[0]
-
-        weather_condition = row['Weather Condition']
-        cursor.execute('''
-            SELECT weather_condition_id FROM WeatherConditions WHERE description = ?
-        ''', (weather_condition,))
-        weather_condition_id = cursor.fetchone()
-        if weather_condition_id is None:
-            cursor.execute('''
-                INSERT INTO WeatherConditions (description)
-                VALUES (?)
-            ''', (weather_condition,))
-            weather_condition_id = cursor.lastrowid
-        else:
-            weather_condition_id = weather_condition_id[0]
-
-        wind_direction = row['Wind Direction']
-        cursor.execute('''
-            SELECT wind_direction_id FROM WindDirections WHERE description = ?
-        ''', (wind_direction,))
-        wind_direction_id = cursor.fetchone()
-        if wind_direction_id is None:
-            cursor.execute('''
-                INSERT INTO WindDirections (description)
-                VALUES (?)
-            ''', (wind_direction,))
-            wind_direction_id = cursor.lastrowid
-        else:
-            wind_direction_id = wind_direction_id[0]
-
-        uv_index = row['UV Index']
-        cursor.execute('''
-            SELECT uv_index_id FROM UVIndexLevels WHERE level = ?
-        ''', (uv_index,))
-        uv_index_id = cursor.fetchone()
-        if uv_index_id is None:
-            cursor.execute('''
-                INSERT INTO UVIndexLevels (level)
-                VALUES (?)
-            ''', (uv_index,))
-            uv_index_id = cursor.lastrowid
-        else:
-            uv_index_id = uv_index_id[0]
-
-        pollen = row['Pollen']
-        cursor.execute('''
-            SELECT pollen_id FROM PollenLevels WHERE level = ?
-        ''', (pollen,))
-        pollen_id = cursor.fetchone()
-        if pollen_id is None:
-            cursor.execute('''
-                INSERT INTO PollenLevels (level)
-                VALUES (?)
-            ''', (pollen,))
-            pollen_id = cursor.lastrowid
-        else:
-            pollen_id = pollen_id[0]
-
-        pollution = row['Pollution']
-        cursor.execute('''
-            SELECT pollution_id FROM PollutionLevels WHERE level = ?
-        ''', (pollution,))
-        pollution_id = cursor.fetchone()
-        if pollution_id is None:
-            cursor.execute('''
-                INSERT INTO PollutionLevels (level)
-                VALUES (?)
-            ''', (pollution,))
-            pollution_id = cursor.lastrowid
-        else:
-            pollution_id = pollution_id[0]
-
-        visibility = row['Visibility']
-        cursor.execute('''
-            SELECT visibility_id FROM VisibilityLevels WHERE description = ?
-        ''', (visibility,))
-        visibility_id = cursor.fetchone()
-        if visibility_id is None:
-            cursor.execute('''
-                INSERT INTO VisibilityLevels (description)
-                VALUES (?)
-            ''', (visibility,))
-            visibility_id = cursor.lastrowid
-        else:
-            visibility_id = visibility_id[0]
-
-        # For WeatherReports, insert if not exists based on time_of_search
-        time_of_search = row['Time of Search']
-        cursor.execute('''
-            SELECT COUNT(*) FROM WeatherReports WHERE time_of_search = ?
-        ''', (time_of_search,))
-        if cursor.fetchone()[0] == 0:
-            # Prepare values for insertion into WeatherReports
-            values = (
-                time_of_search, row['High Temperature(°C)'], row['Low Temperature(°C)'], row['Current Temperature(°C)'],
-                weather_condition_id, row['Wind Speed(mph)'], row['Humidity(%)'], row['Pressure(mb)'], visibility_id,
-                location_id, wind_direction_id, uv_index_id, pollen_id, pollution_id,
-                row['Chance of Precipitation(%)'], row['Sunset'], row['Sunrise'],
-                row['Low Tide Morning Time'], row['Low Tide Morning Height(M)'],
-                row['High Tide Morning Time'], row['High Tide Morning Height(M)'],
-                row['Low Tide Evening Time'], row['Low Tide Evening Height(M)'],
-                row['High Tide Evening Time'], row['High Tide Evening Height(M)']
-            )
-
-            # Insert data into WeatherReports
-            cursor.execute('''
-                INSERT INTO WeatherReports (
-                    time_of_search, high_temperature, low_temperature, current_temperature,
-                    weather_condition_id, wind_speed, humidity, pressure, visibility_id,
-                    location_id, wind_direction_id, uv_index_id, pollen_id, pollution_id,
-                    chance_of_precipitation, sunset, sunrise, low_tide_morning_time,
-                    low_tide_morning_height, high_tide_morning_time, high_tide_morning_height,
-                    low_tide_evening_time, low_tide_evening_height, high_tide_evening_time,
-                    high_tide_evening_height
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', values)
-
-# Commit changes and close the connection
-conn.commit()
-
-
-# Define CTE queries for each table to remove duplicates
-cte_queries = {
-    'Locations': '''
-        WITH RankedLocations AS (
-            SELECT rowid, name,
-                   ROW_NUMBER() OVER (PARTITION BY name ORDER BY rowid) AS rn
-            FROM Locations
-        )
-        DELETE FROM Locations
-        WHERE rowid IN (
-            SELECT rowid
-            FROM RankedLocations
-            WHERE rn > 1
-        );
-    ''',
-    'WeatherConditions': '''
-        WITH RankedWeatherConditions AS (
-            SELECT rowid, description,
-                   ROW_NUMBER() OVER (PARTITION BY description ORDER BY rowid) AS rn
-            FROM WeatherConditions
-        )
-        DELETE FROM WeatherConditions
-        WHERE rowid IN (
-            SELECT rowid
-            FROM RankedWeatherConditions
-            WHERE rn > 1
-        );
-    ''',
-    'UVIndexLevels': '''
-        WITH RankedUVIndexLevels AS (
-            SELECT rowid, level,
-                   ROW_NUMBER() OVER (PARTITION BY level ORDER BY rowid) AS rn
-            FROM UVIndexLevels
-        )
-        DELETE FROM UVIndexLevels
-        WHERE rowid IN (
-            SELECT rowid
-            FROM RankedUVIndexLevels
-            WHERE rn > 1
-        );
-    ''',
-    'PollenLevels': '''
-        WITH RankedPollenLevels AS (
-            SELECT rowid, level,
-                   ROW_NUMBER() OVER (PARTITION BY level ORDER BY rowid) AS rn
-            FROM PollenLevels
-        )
-        DELETE FROM PollenLevels
-        WHERE rowid IN (
-            SELECT rowid
-            FROM RankedPollenLevels
-            WHERE rn > 1
-        );
-    ''',
-    'PollutionLevels': '''
-        WITH RankedPollutionLevels AS (
-            SELECT rowid, level,
-                   ROW_NUMBER() OVER (PARTITION BY level ORDER BY rowid) AS rn
-            FROM PollutionLevels
-        )
-        DELETE FROM PollutionLevels
-        WHERE rowid IN (
-            SELECT rowid
-            FROM RankedPollutionLevels
-            WHERE rn > 1
-        );
-    ''',
-    'WindDirections': '''
-        WITH RankedWindDirections AS (
-            SELECT rowid, description,
-                   ROW_NUMBER() OVER (PARTITION BY description ORDER BY rowid) AS rn
-            FROM WindDirections
-        )
-        DELETE FROM WindDirections
-        WHERE rowid IN (
-            SELECT rowid
-            FROM RankedWindDirections
-            WHERE rn > 1
-        );
-    ''',
-    'VisibilityLevels': '''
-        WITH RankedVisibilityLevels AS (
-            SELECT rowid, description,
-                   ROW_NUMBER() OVER (PARTITION BY description ORDER BY rowid) AS rn
-            FROM VisibilityLevels
-        )
-        DELETE FROM VisibilityLevels
-        WHERE rowid IN (
-            SELECT rowid
-            FROM RankedVisibilityLevels
-            WHERE rn > 1
-        );
-    '''
-}
-
-# Process each table
-for table_name, cte_sql in cte_queries.items():
-    print(f"Processing {table_name}...")
-    cursor.execute(cte_sql)
-    conn.commit()
-    print(f"Removed duplicates from {table_name}.")
-
-# Close the connection
-conn.close()
-
-print("All tables processed successfully.")
+
+def main():
+    try:
+        run()
+    finally:
+        metrics.write()
+
+
+def run():
+    logger.info(f"Python version: {sys.version}")
+    logger.info(f"Working directory: {os.getcwd()}")
+
+    # Set up Google Sheets credentials
+    scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
+    try:
+        creds_json = os.environ.get('GOOGLE_CREDENTIALS')
+        if not creds_json:
+            raise ValueError("GOOGLE_CREDENTIALS environment variable not found")
+
+        creds_dict = json.loads(creds_json)
+        creds = ServiceAccountCredentials.from_json_keyfile_dict(creds_dict, scope)
+        logger.info("Google Sheets API credentials loaded")
+    except Exception as e:
+        logger.error(f"Error loading credentials: {e}")
+        raise
+    client = gspread.authorize(creds)
+    metrics.increment('weather_sheets_api_calls_total', call='open_by_url')
+    sheet = client.open_by_url(spreadsheet_url)
+
+    # Connect to the SQLite database; in monthly storage the dimension database
+    if partitions.storage_mode == 'monthly':
+        conn = partitions.connect_dimensions()
+    else:
+        conn = weather_db.connect(database_file_path)
+
+    # Load the small dimension tables once so ids are resolved in memory
+    dimension_ids = weather_db.load_dimension_ids(conn)
+    logger.info(f"Loaded dimension ids: { {table: len(ids) for table, ids in dimension_ids.items()} }")
+
+    # Read only the rows appended since each sheet's watermark, all sheets in one request
+    # Every sheet targeted by the location registry, across all shards
+    worksheet_names = sheet_names(load_locations())
+    sync_state = load_sync_state(conn)
+    with metrics.timer('weather_phase_seconds', phase='fetch_rows'):
+        new_rows = fetch_new_rows(sheet, worksheet_names, sync_state)
+    with metrics.timer('weather_phase_seconds', phase='ingest'):
+        ingest_new_rows(conn, new_rows, dimension_ids)
+
+    # Keep the query planner's statistics current with the new rows
+    with metrics.timer('weather_phase_seconds', phase='optimize'):
+        weather_db.optimize(conn)
+
+    # Close the connection
+    conn.close()
+
+    logger.info("Database update complete.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,430 @@
+import sqlite3
+
+from instrumentation import get_logger
+from weather_record import ForecastRecord, WeatherRecord
+
+
+logger = get_logger('weather_db')
+
+
+database_file_path = 'data/nationwide_weather.db'
+
+# Dimension tables as (table, id column, value column, WeatherRecord field)
+dimension_tables = [
+    ('Locations', 'location_id', 'name', 'location'),
+    ('WeatherConditions', 'weather_condition_id', 'description', 'weather_condition'),
+    ('WindDirections', 'wind_direction_id', 'description', 'wind_direction'),
+    ('UVIndexLevels', 'uv_index_id', 'level', 'uv_index'),
+    ('PollenLevels', 'pollen_id', 'level', 'pollen'),
+    ('PollutionLevels', 'pollution_id', 'level', 'pollution'),
+    ('VisibilityLevels', 'visibility_id', 'description', 'visibility'),
+]
+
+# Dimension values joined onto reports by readers, as column -> (table, alias, id column, value column)
+dimension_columns = {
+    'location': ('Locations', 'loc', 'location_id', 'name'),
+    'weather_condition': ('WeatherConditions', 'wc', 'weather_condition_id', 'description'),
+    'visibility': ('VisibilityLevels', 'vl', 'visibility_id', 'description'),
+    'wind_direction': ('WindDirections', 'wd', 'wind_direction_id', 'description'),
+    'uv_index': ('UVIndexLevels', 'uv', 'uv_index_id', 'level'),
+    'pollen': ('PollenLevels', 'pl', 'pollen_id', 'level'),
+    'pollution': ('PollutionLevels', 'pol', 'pollution_id', 'level'),
+}
+
+# WeatherReports columns in insert order, as (column, WeatherRecord field or dimension table)
+report_columns = [
+    ('time_of_search', 'time_of_search'),
+    ('high_temperature', 'high_temperature'),
+    ('low_temperature', 'low_temperature'),
+    ('current_temperature', 'current_temperature'),
+    ('weather_condition_id', 'WeatherConditions'),
+    ('wind_speed', 'wind_speed'),
+    ('humidity', 'humidity'),
+    ('pressure', 'pressure'),
+    ('visibility_id', 'VisibilityLevels'),
+    ('location_id', 'Locations'),
+    ('wind_direction_id', 'WindDirections'),
+    ('uv_index_id', 'UVIndexLevels'),
+    ('pollen_id', 'PollenLevels'),
+    ('pollution_id', 'PollutionLevels'),
+    ('chance_of_precipitation', 'chance_of_precipitation'),
+    ('sunset', 'sunset'),
+    ('sunrise', 'sunrise'),
+    ('low_tide_morning_time', 'low_tide_morning_time'),
+    ('low_tide_morning_height', 'low_tide_morning_height'),
+    ('high_tide_morning_time', 'high_tide_morning_time'),
+    ('high_tide_morning_height', 'high_tide_morning_height'),
+    ('low_tide_evening_time', 'low_tide_evening_time'),
+    ('low_tide_evening_height', 'low_tide_evening_height'),
+    ('high_tide_evening_time', 'high_tide_evening_time'),
+    ('high_tide_evening_height', 'high_tide_evening_height'),
+]
+
+# Forecast table of each ForecastRecord granularity
+forecast_tables = {'day': 'DailyForecasts', 'hour': 'HourlyForecasts'}
+
+# Forecast table columns in insert order, as (column, ForecastRecord field or dimension table)
+forecast_columns = [
+    ('location_id', 'Locations'),
+    ('issued_at', 'issued_at'),
+    ('target_time', 'target_time'),
+    ('high_temperature', 'high_temperature'),
+    ('low_temperature', 'low_temperature'),
+    ('temperature', 'temperature'),
+    ('weather_condition_id', 'WeatherConditions'),
+    ('wind_speed', 'wind_speed'),
+    ('humidity', 'humidity'),
+    ('pressure', 'pressure'),
+    ('visibility_id', 'VisibilityLevels'),
+    ('wind_direction_id', 'WindDirections'),
+    ('chance_of_precipitation', 'chance_of_precipitation'),
+]
+
+# Tables whose rows can be rewritten in place after they were inserted (by a backfill or a migration);
+# a trigger records every rewrite in ChangedRows so incremental Postgres syncs can push it again
+tracked_tables = ['WeatherReports', *forecast_tables.values()]
+
+# Matches the filesystem block size; rows are a few hundred bytes, so larger pages only waste cache
+page_size = 4096
+
+
+def dimension_dedup_statements():
+    """SQL that points every reference to a duplicate dimension value at its first id, then deletes the duplicates."""
+    statements = []
+    for table, id_column, value_column, _ in dimension_tables:
+        duplicate_ids = f'''
+            SELECT {id_column} FROM {table} d
+            WHERE {id_column} > (SELECT MIN({id_column}) FROM {table} WHERE {value_column} = d.{value_column})
+        '''
+        first_id = f'''
+            SELECT MIN(keep.{id_column}) FROM {table} keep JOIN {table} old ON keep.{value_column} = old.{value_column}
+            WHERE old.{id_column} = referencing.{id_column}
+        '''
+        referencing_tables = []
+        if any(source == table for _, source in report_columns):
+            referencing_tables.append('WeatherReports')
+        if any(source == table for _, source in forecast_columns):
+            referencing_tables += forecast_tables.values()
+        # OR REPLACE keeps one forecast where merging two locations' ids collides on the unique key
+        statements += [
+            f'''
+                UPDATE OR REPLACE {referencing} AS referencing SET {id_column} = ({first_id})
+                WHERE {id_column} IN ({duplicate_ids})
+            '''
+            for referencing in referencing_tables
+        ]
+        statements.append(f'DELETE FROM {table} WHERE {id_column} IN ({duplicate_ids})')
+    return statements
+
+
+def dimension_indexes(schema='main'):
+    """SQL for the unique index on each dimension table's value column."""
+    return [
+        f'CREATE UNIQUE INDEX IF NOT EXISTS {schema}.idx_{table.lower()}_{value_column} ON {table} ({value_column})'
+        for table, _, value_column, _ in dimension_tables
+    ]
+
+
+# Range reads by city and date are index seeks
+report_indexes = [
+    'CREATE INDEX IF NOT EXISTS idx_weather_reports_location_time ON WeatherReports (location_id, time_of_search)',
+    'CREATE INDEX IF NOT EXISTS idx_weather_reports_time ON WeatherReports (time_of_search)',
+]
+
+# Versioned schema changes applied by connect(), each once and in order; PRAGMA user_version holds
+# the last one applied
+sqlite_migrations = [
+    (1, "index reports by location and time of search", report_indexes),
+    (2, "unique dimension values", dimension_dedup_statements() + dimension_indexes() + [
+        # Rollups of merged ids are rebuilt from scratch by the next refresh_rollups
+        f'DROP TABLE IF EXISTS {prefix}{table}'
+        for prefix in ('Hourly', 'Daily') for table in ('WeatherRollups', 'ConditionCounts')
+    ]),
+    (3, "page size and write-ahead log", [
+        # The page size can only change outside WAL mode and takes effect on VACUUM
+        'PRAGMA journal_mode = DELETE',
+        f'PRAGMA page_size = {page_size}',
+        'VACUUM',
+        'PRAGMA journal_mode = WAL',
+    ]),
+]
+
+
+def connect(path=database_file_path):
+    """Opens the weather database, creating the normalized schema and applying any pending migrations."""
+    conn = sqlite3.connect(path)
+    create_schema(conn)
+    migrate(conn)
+    # WAL only needs to sync at checkpoints; a crash can lose the last commits but never corrupts the file
+    conn.execute('PRAGMA synchronous = NORMAL')
+    return conn
+
+
+def migrate(conn):
+    """Applies the sqlite_migrations newer than the database's user_version, one transaction each."""
+    current = conn.execute('PRAGMA user_version').fetchone()[0]
+    for version, description, statements in sqlite_migrations:
+        if version <= current:
+            continue
+        with conn:
+            for statement in statements:
+                conn.execute(statement)
+            conn.execute(f'PRAGMA user_version = {version}')
+        logger.info(f"Applied SQLite migration {version}: {description}")
+
+
+def optimize(conn):
+    """Refreshes the query planner's statistics after an ingest has been committed."""
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'").fetchone() is None:
+        conn.execute('ANALYZE')
+    else:
+        conn.execute('PRAGMA optimize')
+
+
+def create_schema(conn):
+    """Creates the dimension tables, WeatherReports and the forecast tables if they do not exist yet."""
+    create_dimension_schema(conn)
+    create_report_schema(conn)
+
+
+def create_dimension_schema(conn, schema='main'):
+    """Creates the dimension tables in the given attached database if they do not exist yet."""
+    for table, id_column, value_column, _ in dimension_tables:
+        conn.execute(f'''
+            CREATE TABLE IF NOT EXISTS {schema}.{table} (
+                {id_column} INTEGER PRIMARY KEY AUTOINCREMENT,
+                {value_column} TEXT NOT NULL
+            )
+        ''')
+
+
+def create_report_schema(conn):
+    """Creates WeatherReports, the forecast tables and ChangedRows in the main database if they do not exist yet."""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS WeatherReports (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            time_of_search TEXT,
+            high_temperature REAL,
+            low_temperature REAL,
+            current_temperature REAL,
+            weather_condition_id INTEGER,
+            wind_speed REAL,
+            humidity REAL,
+            pressure REAL,
+            visibility_id INTEGER,
+            location_id INTEGER,
+            wind_direction_id INTEGER,
+            uv_index_id INTEGER,
+            pollen_id INTEGER,
+            pollution_id INTEGER,
+            chance_of_precipitation REAL,
+            sunset TEXT,
+            sunrise TEXT,
+            low_tide_morning_time TEXT,
+            low_tide_morning_height REAL,
+            high_tide_morning_time TEXT,
+            high_tide_morning_height REAL,
+            low_tide_evening_time TEXT,
+            low_tide_evening_height REAL,
+            high_tide_evening_time TEXT,
+            high_tide_evening_height REAL,
+            FOREIGN KEY (weather_condition_id) REFERENCES WeatherConditions(weather_condition_id),
+            FOREIGN KEY (visibility_id) REFERENCES VisibilityLevels(visibility_id),
+            FOREIGN KEY (location_id) REFERENCES Locations(location_id),
+            FOREIGN KEY (wind_direction_id) REFERENCES WindDirections(wind_direction_id),
+            FOREIGN KEY (uv_index_id) REFERENCES UVIndexLevels(uv_index_id),
+            FOREIGN KEY (pollen_id) REFERENCES PollenLevels(pollen_id),
+            FOREIGN KEY (pollution_id) REFERENCES PollutionLevels(pollution_id)
+        )
+    ''')
+
+    # Forecasts are identified by location, the time the page was fetched and the time forecast
+    for table in forecast_tables.values():
+        conn.execute(f'''
+            CREATE TABLE IF NOT EXISTS {table} (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                location_id INTEGER,
+                issued_at TEXT NOT NULL,
+                target_time TEXT NOT NULL,
+                high_temperature REAL,
+                low_temperature REAL,
+                temperature REAL,
+                weather_condition_id INTEGER,
+                wind_speed REAL,
+                humidity REAL,
+                pressure REAL,
+                visibility_id INTEGER,
+                wind_direction_id INTEGER,
+                chance_of_precipitation REAL,
+                UNIQUE (location_id, issued_at, target_time),
+                FOREIGN KEY (location_id) REFERENCES Locations(location_id),
+                FOREIGN KEY (weather_condition_id) REFERENCES WeatherConditions(weather_condition_id),
+                FOREIGN KEY (visibility_id) REFERENCES VisibilityLevels(visibility_id),
+                FOREIGN KEY (wind_direction_id) REFERENCES WindDirections(wind_direction_id)
+            )
+        ''')
+        conn.execute(f'''
+            CREATE INDEX IF NOT EXISTS idx_{table.lower()}_location_target
+            ON {table} (location_id, target_time)
+        ''')
+
+    # Every in-place rewrite gets the next revision of its table, in the order the rewrites happen
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS ChangedRows (
+            table_name TEXT NOT NULL,
+            id INTEGER NOT NULL,
+            revision INTEGER NOT NULL,
+            PRIMARY KEY (table_name, id)
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_changed_rows_revision ON ChangedRows (table_name, revision)')
+    for table in tracked_tables:
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS track_{table.lower()}_updates AFTER UPDATE ON {table}
+            BEGIN
+                INSERT OR REPLACE INTO ChangedRows (table_name, id, revision)
+                VALUES ('{table}', NEW.id, (
+                    SELECT COALESCE(MAX(revision), 0) + 1 FROM ChangedRows WHERE table_name = '{table}'
+                ));
+            END
+        ''')
+
+
+def load_dimension_ids(conn):
+    """Loads every dimension table into a dict of table -> value -> id."""
+    dimension_ids = {}
+    for table, id_column, value_column, _ in dimension_tables:
+        # Databases from before the unique dimension values migration can hold duplicates; keep the first id
+        rows = conn.execute(f'SELECT {value_column}, MIN({id_column}) FROM {table} GROUP BY {value_column}')
+        dimension_ids[table] = dict(rows)
+    return dimension_ids
+
+
+def get_dimension_id(conn, dimension_ids, table, value):
+    """Resolves a dimension value to its id, inserting it the first time it is seen."""
+    if value is None:
+        return None
+    ids = dimension_ids[table]
+    if value not in ids:
+        _, _, value_column, _ = next(dimension for dimension in dimension_tables if dimension[0] == table)
+        cursor = conn.execute(f'INSERT INTO {table} ({value_column}) VALUES (?)', (value,))
+        ids[value] = cursor.lastrowid
+    return ids[value]
+
+
+def report_exists(conn, location_id, time_of_search):
+    """Checks for a stored report with an index seek on (location_id, time_of_search)."""
+    row = conn.execute(
+        'SELECT 1 FROM WeatherReports WHERE location_id = ? AND time_of_search = ? LIMIT 1',
+        (location_id, time_of_search)).fetchone()
+    return row is not None
+
+
+def record_rows(conn, records, record_type, columns, dimension_ids=None):
+    """Yields one table row per record in the given column order, resolving dimension ids."""
+    if dimension_ids is None:
+        dimension_ids = load_dimension_ids(conn)
+
+    field_index = {field: i for i, field in enumerate(record_type._fields)}
+    dimension_fields = {
+        table: field_index[field] for table, _, _, field in dimension_tables
+        if any(source == table for _, source in columns)
+    }
+    column_sources = [
+        (True, source) if source in dimension_fields else (False, field_index[source])
+        for _, source in columns
+    ]
+
+    for record in records:
+        values = record.to_row()
+        dimension_values = {
+            table: get_dimension_id(conn, dimension_ids, table, values[index])
+            for table, index in dimension_fields.items()
+        }
+        row = tuple(
+            dimension_values[source] if is_dimension else values[source]
+            for is_dimension, source in column_sources
+        )
+        yield row
+
+
+def report_rows(conn, records, dimension_ids=None):
+    """Yields (location_id, time_of_search, WeatherReports row) per WeatherRecord."""
+    location_index = next(i for i, (column, _) in enumerate(report_columns) if column == 'location_id')
+    time_index = next(i for i, (column, _) in enumerate(report_columns) if column == 'time_of_search')
+    for row in record_rows(conn, records, WeatherRecord, report_columns, dimension_ids):
+        yield row[location_index], row[time_index], row
+
+
+def insert_weather_records(conn, records, dimension_ids=None):
+    """Inserts WeatherRecords into WeatherReports, skipping ones already stored.
+
+    A record is already stored when WeatherReports has a row for the same
+    location and time of search. Returns the number of rows inserted; the
+    caller owns the transaction.
+    """
+    seen = set()
+    rows = []
+    for location_id, time_of_search, row in report_rows(conn, records, dimension_ids):
+        key = (location_id, time_of_search)
+        if key in seen or report_exists(conn, *key):
+            continue
+        seen.add(key)
+        rows.append(row)
+
+    columns = ', '.join(column for column, _ in report_columns)
+    placeholders = ', '.join('?' for _ in report_columns)
+    conn.executemany(f'INSERT INTO WeatherReports ({columns}) VALUES ({placeholders})', rows)
+    return len(rows)
+
+
+def upsert_weather_records(conn, records, dimension_ids=None):
+    """Stores WeatherRecords, overwriting the report already stored for the same location and time of search.
+
+    Used to replace rows with re-parsed values. Returns the ids of the
+    WeatherReports rows written; the caller owns the transaction.
+    """
+    columns = ', '.join(column for column, _ in report_columns)
+    placeholders = ', '.join('?' for _ in report_columns)
+    assignments = ', '.join(f'{column} = ?' for column, _ in report_columns)
+
+    report_ids = []
+    for location_id, time_of_search, row in report_rows(conn, records, dimension_ids):
+        existing = conn.execute(
+            'SELECT id FROM WeatherReports WHERE location_id = ? AND time_of_search = ? ORDER BY id LIMIT 1',
+            (location_id, time_of_search)).fetchone()
+        if existing:
+            conn.execute(f'UPDATE WeatherReports SET {assignments} WHERE id = ?', row + existing)
+            report_ids.append(existing[0])
+        else:
+            cursor = conn.execute(f'INSERT INTO WeatherReports ({columns}) VALUES ({placeholders})', row)
+            report_ids.append(cursor.lastrowid)
+    return report_ids
+
+
+def upsert_forecast_records(conn, records, dimension_ids=None):
+    """Stores ForecastRecords in their granularity's table, replacing the values of a forecast seen before.
+
+    Returns the number of forecasts written; the caller owns the transaction.
+    """
+    columns = ', '.join(column for column, _ in forecast_columns)
+    placeholders = ', '.join('?' for _ in forecast_columns)
+    updates = ', '.join(
+        f'{column} = excluded.{column}' for column, _ in forecast_columns
+        if column not in ('location_id', 'issued_at', 'target_time'))
+
+    records = list(records)
+    if dimension_ids is None:
+        dimension_ids = load_dimension_ids(conn)
+
+    written = 0
+    for granularity, table in forecast_tables.items():
+        rows = list(record_rows(
+            conn, (record for record in records if record.granularity == granularity),
+            ForecastRecord, forecast_columns, dimension_ids))
+        conn.executemany(f'''
+            INSERT INTO {table} ({columns}) VALUES ({placeholders})
+            ON CONFLICT (location_id, issued_at, target_time) DO UPDATE SET {updates}
+        ''', rows)
+        written += len(rows)
+    return written
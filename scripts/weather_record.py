@@ -0,0 +1,190 @@
+from datetime import datetime, time
+from typing import NamedTuple, Optional, get_args
+
+from instrumentation import get_logger
+
+
+logger = get_logger('weather_record')
+
+
+# Placeholder written to Google Sheets for a field the page didn't have
+missing_value = 'N/A'
+
+time_of_search_format = '%Y-%m-%d %H:%M:%S'
+time_format = '%H:%M'
+
+
+class WeatherRecord(NamedTuple):
+    """One location's scraped weather, typed once at extraction; missing fields are None."""
+    time_of_search: datetime
+    high_temperature: Optional[float]
+    low_temperature: Optional[float]
+    current_temperature: Optional[float]
+    weather_condition: Optional[str]
+    wind_speed: Optional[float]
+    humidity: Optional[float]
+    pressure: Optional[float]
+    visibility: Optional[str]
+    location: Optional[str]
+    wind_direction: Optional[str]
+    uv_index: Optional[str]
+    pollen: Optional[str]
+    pollution: Optional[str]
+    chance_of_precipitation: Optional[float]
+    sunset: Optional[time]
+    sunrise: Optional[time]
+    low_tide_morning_time: Optional[time]
+    low_tide_morning_height: Optional[float]
+    high_tide_morning_time: Optional[time]
+    high_tide_morning_height: Optional[float]
+    low_tide_evening_time: Optional[time]
+    low_tide_evening_height: Optional[float]
+    high_tide_evening_time: Optional[time]
+    high_tide_evening_height: Optional[float]
+
+    @classmethod
+    def from_values(cls, values):
+        """Builds a record from a dict of field -> raw scraped value, parsing each one."""
+        return cls(*(field_parsers[field](values.get(field)) for field in cls._fields))
+
+    @classmethod
+    def from_sheet_row(cls, headers, row):
+        """Builds a record from a Google Sheets row laid out under the given headers."""
+        values = dict(zip(headers, row))
+        return cls(*(field_parsers[field](values.get(header)) for field, header in field_headers.items()))
+
+    @classmethod
+    def from_json(cls, data):
+        """Builds a record from a spooled JSON object; older segments are keyed by header."""
+        return cls(*(field_parsers[field](data.get(field, data.get(header))) for field, header in field_headers.items()))
+
+    def to_sheet_row(self):
+        """Serializes the record as a Google Sheets row in header order."""
+        return [missing_value if value is None else text_value(value) for value in self]
+
+    def to_row(self):
+        """Serializes the record as a tuple in field order for SQLite; missing fields stay None."""
+        return tuple(map(text_value, self))
+
+    def to_json(self):
+        """Serializes the record as a JSON-ready dict keyed by field name."""
+        return dict(zip(self._fields, self.to_row()))
+
+
+class ForecastRecord(NamedTuple):
+    """One day or hourly slot of the forecast on a weather page, issued at its time of search."""
+    location: Optional[str]
+    issued_at: datetime
+    target_time: datetime
+    granularity: str
+    high_temperature: Optional[float]
+    low_temperature: Optional[float]
+    temperature: Optional[float]
+    weather_condition: Optional[str]
+    wind_speed: Optional[float]
+    humidity: Optional[float]
+    pressure: Optional[float]
+    visibility: Optional[str]
+    wind_direction: Optional[str]
+    chance_of_precipitation: Optional[float]
+
+    @classmethod
+    def from_values(cls, values):
+        """Builds a forecast from a dict of field -> raw scraped value, parsing each one."""
+        return cls(*(forecast_field_parsers[field](values.get(field)) for field in cls._fields))
+
+    @classmethod
+    def from_json(cls, data):
+        """Builds a forecast from a spooled JSON object."""
+        return cls.from_values(data)
+
+    def to_row(self):
+        """Serializes the forecast as a tuple in field order for SQLite; missing fields stay None."""
+        return tuple(map(text_value, self))
+
+    def to_json(self):
+        """Serializes the forecast as a JSON-ready dict keyed by field name."""
+        return dict(zip(self._fields, self.to_row()))
+
+
+def text_value(value):
+    """Renders times as text for the sinks that store them as text; other values pass through."""
+    if isinstance(value, datetime):
+        return value.strftime(time_of_search_format)
+    if isinstance(value, time):
+        return value.strftime(time_format)
+    return value
+
+
+def parse_missing(value):
+    """Returns None for the empty and 'N/A' placeholders, else the value with whitespace stripped."""
+    if isinstance(value, str):
+        value = value.strip()
+        if value in ('', missing_value):
+            return None
+    return value
+
+
+def parse_float(value):
+    value = parse_missing(value)
+    if value is None:
+        return None
+    try:
+        return float(value.rstrip('mM') if isinstance(value, str) else value)
+    except (TypeError, ValueError):
+        logger.warning(f"Failed to convert '{value}' to a number")
+        return None
+
+
+def parse_time(value):
+    value = parse_missing(value)
+    if value is None or isinstance(value, time):
+        return value
+    try:
+        return datetime.strptime(value, time_format).time()
+    except (TypeError, ValueError):
+        logger.warning(f"Failed to convert time string '{value}'")
+        return None
+
+
+def parse_datetime(value):
+    value = parse_missing(value)
+    if value is None or isinstance(value, datetime):
+        return value
+    try:
+        return datetime.strptime(value, time_of_search_format)
+    except (TypeError, ValueError):
+        logger.warning(f"Failed to convert time of search '{value}'")
+        return None
+
+
+def parse_text(value):
+    value = parse_missing(value)
+    return None if value is None else str(value)
+
+
+# Parser for each field, picked by its annotated type
+type_parsers = {float: parse_float, time: parse_time, datetime: parse_datetime, str: parse_text}
+
+
+def record_parsers(record_type):
+    return {
+        field: type_parsers[(get_args(hint) or (hint,))[0]]
+        for field, hint in record_type.__annotations__.items()
+    }
+
+
+field_parsers = record_parsers(WeatherRecord)
+forecast_field_parsers = record_parsers(ForecastRecord)
+
+headers = [
+    'Time of Search', 'High Temperature(°C)', 'Low Temperature(°C)', 'Current Temperature(°C)',
+    'Weather Condition', 'Wind Speed(mph)', 'Humidity(%)', 'Pressure(mb)', 'Visibility', 'Location',
+    'Wind Direction', 'UV Index', 'Pollen', 'Pollution', 'Chance of Precipitation(%)',
+    'Sunset', 'Sunrise', 'Low Tide Morning Time', 'Low Tide Morning Height(M)',
+    'High Tide Morning Time', 'High Tide Morning Height(M)', 'Low Tide Evening Time',
+    'Low Tide Evening Height(M)', 'High Tide Evening Time', 'High Tide Evening Height(M)'
+]
+
+# Google Sheets header of each field, in column order
+field_headers = dict(zip(WeatherRecord._fields, headers))